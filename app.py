@@ -1,29 +1,36 @@
 # app.py
 # Ponto de entrada principal da aplicação Otimizador de Rotas e Mapas 3.0.
 # Este script utiliza o Streamlit para criar a interface gráfica do usuário.
-# VERSÃO 3.1.23: Implementada a tela de resolução de divergências.
+# VERSÃO 3.1.87: Duplicatas só com as mesmas coordenadas e o mesmo nome.
 
 import streamlit as st
 import pandas as pd
-import re
-from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode, DataReturnMode, JsCode
+import numpy as np
+import json
+import time
+import gc
+import hashlib
+import io
+import codecs
+import copy
+import sys
+import threading
+from pathlib import Path
+from collections import OrderedDict
 
 # --- Importação dos nossos módulos da pasta src ---
 from src.data_handler import (
     process_uploaded_file, process_mymaps_link, process_drive_link, 
-    process_raw_text, extract_coords_from_text, clean_data, add_maps_link_column
+    process_raw_text, extract_coords_from_text, extract_coords_from_series,
+    clean_data, add_maps_link_column, drop_duplicate_points, DECIMAL_RE
 )
-from src.optimizer import ortools_optimizer
-from src.services import optimize_route_online, geocode_address, autocomplete_address
-from src.exporter import (
-    create_interactive_map, export_to_csv, export_to_geojson,
-    export_to_kml, export_to_gpx, generate_google_maps_links,
-    export_to_mymaps_csv
-)
-from src.gemini_services import (
-    enrich_data_with_gemini, standardize_names_with_gemini, find_duplicates_with_gemini
+from src.services import (
+    optimize_route_online, geocode_address, geocode_many, autocomplete_address_async, warm_up_connection
 )
 from src.utils import get_api_keys
+# Os módulos pesados (st_aggrid, src.optimizer com OR-Tools, src.exporter com folium
+# e src.gemini_services com google-generativeai) são importados dentro das funções
+# que os usam, para que a primeira tela do app não pague pelo carregamento deles.
 
 # --- CONFIGURAÇÃO DA PÁGINA ---
 st.set_page_config(
@@ -32,6 +39,61 @@ st.set_page_config(
     page_icon="🗺️"
 )
 
+# --- CONSTANTES ---
+
+# Colunas e tipos dos pontos da rota (buffer de novos pontos, rota manual e mapeamento).
+POINT_COLUMNS = ['Nome', 'Latitude', 'Longitude']
+POINT_DTYPES = {'Latitude': np.float64, 'Longitude': np.float64}
+
+# O autocomplete só é consultado a partir deste número de caracteres...
+AUTOCOMPLETE_MIN_CHARS = 5
+# ...e com pelo menos este intervalo (em segundos) entre duas consultas.
+AUTOCOMPLETE_MIN_INTERVAL = 0.35
+# Intervalo (em segundos) entre as verificações enquanto uma consulta está pendente.
+AUTOCOMPLETE_POLL_INTERVAL = 0.25
+# Validade (em segundos) e tamanho do cache em memória de geocodificação.
+GEOCODE_MEMORY_TTL = 86400
+GEOCODE_MEMORY_ENTRIES = 2048
+# Número máximo de rotas (offline e online) guardadas em cache.
+ROUTE_CACHE_ENTRIES = 16
+# Número máximo de tabelas processadas pelas ferramentas de IA guardadas em memória.
+AI_TABLE_RESULT_ENTRIES = 4
+# Validade (em segundos) do resultado de um link do My Maps ou do Drive: o conteúdo
+# pode mudar na origem sem que o link mude.
+REMOTE_SOURCE_TTL = 300
+
+# Pasta servida pelo Streamlit em /app/static quando server.enableStaticServing está ativo.
+MAP_STATIC_DIR = Path(__file__).parent / "static"
+# Quantos mapas (route_*.html) são mantidos em disco; os mais antigos são apagados.
+MAP_STATIC_KEEP = 32
+
+# Larguras (px) das colunas conhecidas do grid; as demais seguem o tamanho do cabeçalho.
+GRID_COLUMN_WIDTHS = {"Nome": 260, "Latitude": 130, "Longitude": 130, "Endereço": 300, "Categoria": 150}
+
+# Renderizador da coluna virtual "Google Maps" do AgGrid: monta o link no navegador
+# a partir da Latitude/Longitude da linha, sem guardar a URL na tabela.
+LINK_RENDERER_JS = """
+    class LinkRenderer {
+        init(params) {
+            this.eGui = document.createElement('a');
+            const row = params.data || {};
+            const lat = row.Latitude, lon = row.Longitude;
+            if (lat !== null && lat !== undefined && lat !== '' && lon !== null && lon !== undefined && lon !== '') {
+                this.eGui.innerText = 'Abrir no Mapa';
+                this.eGui.setAttribute('href', 'https://www.google.com/maps?q=' + lat + ',' + lon);
+                this.eGui.setAttribute('target', '_blank');
+            }
+        }
+        getGui() {
+            return this.eGui;
+        }
+        refresh() {
+            return false;
+        }
+    }
+"""
+
+
 # --- ESTADO DA SESSÃO E FUNÇÕES AUXILIARES ---
 
 def initialize_session_state():
@@ -41,9 +103,16 @@ def initialize_session_state():
         "raw_data_for_mapping": None, "manual_mapping_required": False,
         "divergence_data": None, "show_divergence_screen": False,
         "route_geojson": None, "total_distance": None, "total_duration": None,
-        "address_input": "", "clear_address_input_flag": False,
+        "address_input": "", "add_point_feedback": None,
         "ai_authenticated": False,
-        "api_keys": None
+        "api_keys": None, "ors_api_key": None,
+        "points_buffer": [],
+        "last_autocomplete_ts": 0.0, "autocomplete_suggestions": [],
+        "last_autocomplete_query": None, "autocomplete_future": None,
+        "autocomplete_pending": False,
+        "signature_memo": None,
+        "grid_options_memo": None,
+        "map_embed_memo": None
     }
     for key, value in defaults.items():
         if key not in st.session_state:
@@ -51,14 +120,394 @@ def initialize_session_state():
 
     if st.session_state.api_keys is None:
         st.session_state.api_keys = get_api_keys()
+        st.session_state.ors_api_key = st.session_state.api_keys.get("ORS_API_KEY")
+        # Início da sessão: a conexão com o ORS é aberta em segundo plano.
+        warm_up_connection()
 
 def clear_session():
     """Limpa todos os dados da sessão para reiniciar o processo."""
-    keys_to_clear = list(st.session_state.keys())
-    for key in keys_to_clear:
-        del st.session_state[key]
+    st.session_state.clear()
+    # Devolve ao alocador a memória dos DataFrames e do GeoJSON da sessão anterior.
+    gc.collect()
+    initialize_session_state()
     st.rerun()
 
+class _UncachedResult(Exception):
+    """Leva um resultado de erro para fora de uma função em cache, sem que ele seja memorizado."""
+    def __init__(self, result):
+        super().__init__()
+        self.result = result
+
+def _raise_if_error(result: dict) -> dict:
+    """Erros costumam ser transitórios (rede, permissões), então não devem ficar em cache."""
+    if not result or result.get('status') == 'error':
+        raise _UncachedResult(result)
+    return result
+
+def _normalize_lookup(text: str) -> str:
+    """Normaliza o texto digitado para maximizar os acertos do cache em memória."""
+    return text.strip().lower()
+
+@st.cache_data(ttl=GEOCODE_MEMORY_TTL, max_entries=GEOCODE_MEMORY_ENTRIES, show_spinner=False)
+def _cached_geocode(query: str, api_key: str):
+    """Geocodificação com cache em memória; falhas (None) não são guardadas."""
+    coords = geocode_address(query, api_key)
+    if coords is None:
+        raise _UncachedResult(None)
+    return coords
+
+def cached_geocode(text: str, api_key: str):
+    """Geocodifica um texto consultando primeiro o cache em memória do processo."""
+    try:
+        return _cached_geocode(_normalize_lookup(text), api_key)
+    except _UncachedResult as e:
+        return e.result
+
+def _schedule_autocomplete():
+    """Callback do campo de endereço: marca que o texto mudou e precisa de sugestões."""
+    st.session_state.autocomplete_pending = True
+
+def _fetch_autocomplete(prefix: str, api_key: str) -> None:
+    """
+    Dispara a busca de sugestões em segundo plano, sem esperar a resposta. Só
+    consulta quando o texto difere do último consultado. Uma consulta anterior
+    que ainda não começou é descartada, já que só a sugestão para o texto mais
+    recente interessa. A busca roda numa thread sem ScriptRunContext, por isso
+    usa autocomplete_address (cache em disco e de prefixos) e não st.cache_data.
+    """
+    if st.session_state.last_autocomplete_query != prefix:
+        stale = st.session_state.autocomplete_future
+        if stale is not None:
+            stale.cancel()
+        st.session_state.autocomplete_future = autocomplete_address_async(prefix, api_key)
+        st.session_state.last_autocomplete_query = prefix
+
+def _advance_autocomplete(prefix: str, api_key: str) -> bool:
+    """
+    Dispara a consulta pendente (respeitando AUTOCOMPLETE_MIN_INTERVAL) e recolhe
+    a resposta se ela já chegou, sem bloquear. Retorna True se as sugestões mudaram.
+    """
+    now = time.monotonic()
+    if st.session_state.autocomplete_pending and now - st.session_state.last_autocomplete_ts > AUTOCOMPLETE_MIN_INTERVAL:
+        _fetch_autocomplete(prefix, api_key)
+        st.session_state.autocomplete_pending = False
+        st.session_state.last_autocomplete_ts = now
+
+    future = st.session_state.autocomplete_future
+    if future is None or not future.done():
+        return False
+    st.session_state.autocomplete_future = None
+    try:
+        st.session_state.autocomplete_suggestions = future.result()
+    except Exception as e:
+        print(f"ERRO: Falha inesperada ao buscar sugestões de endereço: {e}")
+        st.session_state.autocomplete_suggestions = []
+    return True
+
+def _autocomplete_waiting() -> bool:
+    """Há texto esperando ser consultado ou uma consulta ainda sem resposta."""
+    return st.session_state.autocomplete_pending or st.session_state.autocomplete_future is not None
+
+@st.fragment(run_every=AUTOCOMPLETE_POLL_INTERVAL)
+def _poll_autocomplete(prefix: str, api_key: str):
+    """
+    Fragmento sem elementos visíveis, desenhado só enquanto há consulta pendente:
+    sem ele, nenhuma nova execução aconteceria para disparar a consulta adiada
+    nem mostrar a resposta. Quando as sugestões chegam, recarrega o app para
+    exibi-las, o que também encerra a verificação periódica.
+    """
+    if _advance_autocomplete(prefix, api_key) or not _autocomplete_waiting():
+        st.rerun()
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _process_file_cached(file_key: tuple, _uploaded_file) -> dict:
+    return _raise_if_error(process_uploaded_file(_uploaded_file))
+
+@st.cache_data(show_spinner=False, max_entries=4, ttl=REMOTE_SOURCE_TTL)
+def _process_mymaps_cached(url: str) -> dict:
+    return _raise_if_error(process_mymaps_link(url))
+
+@st.cache_data(show_spinner=False, max_entries=4, ttl=REMOTE_SOURCE_TTL)
+def _process_drive_cached(url: str) -> dict:
+    return _raise_if_error(process_drive_link(url))
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _process_text_cached(text_digest: bytes, _text_data: str) -> dict:
+    return _raise_if_error(process_raw_text(_text_data))
+
+def run_cached_processing(kind: str, source) -> dict:
+    """
+    Processa um arquivo, link ou texto reaproveitando resultados anteriores
+    para a mesma entrada, em vez de refazer toda a análise a cada execução.
+    """
+    try:
+        if kind == 'file':
+            content_digest = hashlib.blake2b(source.getvalue(), digest_size=8).digest()
+            return _process_file_cached((source.name, source.size, content_digest), source)
+        if kind == 'mymaps':
+            return _process_mymaps_cached(source)
+        if kind == 'drive':
+            return _process_drive_cached(source)
+        text_digest = hashlib.blake2b(source.encode('utf-8'), digest_size=8).digest()
+        return _process_text_cached(text_digest, source)
+    except _UncachedResult as e:
+        return e.result
+
+def _dataframe_signature(df: pd.DataFrame) -> bytes:
+    """Assinatura rápida do conteúdo (e das colunas) de um DataFrame, usada como chave de cache."""
+    digest = hashlib.blake2b(pd.util.hash_pandas_object(df, index=False).values.tobytes(), digest_size=16)
+    digest.update("|".join(map(str, df.columns)).encode())
+    return digest.digest()
+
+def session_signature(df: pd.DataFrame) -> bytes:
+    """
+    Assinatura de um DataFrame guardado na sessão, calculada uma única vez por
+    objeto. A referência ao próprio DataFrame é mantida para que o `id` não
+    seja reaproveitado por outro objeto enquanto a assinatura estiver em uso.
+    """
+    memo = st.session_state.signature_memo
+    if memo is None or memo[0] is not df:
+        memo = (df, _dataframe_signature(df))
+        st.session_state.signature_memo = memo
+    return memo[1]
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _serialize_session_csv(df_signature: bytes, _df: pd.DataFrame) -> bytes:
+    """
+    Serializa a sessão de trabalho em CSV (UTF-8 com BOM) apenas quando os dados
+    mudam. Usa o escritor CSV do PyArrow (opcional), bem mais rápido que o do
+    pandas; sem o PyArrow, ou com colunas que o Arrow não consegue converter
+    (tipos mistos), usa o `to_csv` do pandas.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+    except ImportError:
+        return _df.to_csv(index=False).encode('utf-8-sig')
+
+    try:
+        table = pa.Table.from_pandas(_df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return _df.to_csv(index=False).encode('utf-8-sig')
+
+    buffer = io.BytesIO()
+    buffer.write(codecs.BOM_UTF8)
+    pa_csv.write_csv(table, buffer)
+    return buffer.getvalue()
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _cached_map_html(df_signature: bytes, geojson_json: str, _df: pd.DataFrame, _geojson) -> str:
+    """
+    Gera o HTML do mapa apenas quando a rota ou o GeoJSON mudam.
+    Somente a assinatura e o GeoJSON serializado compõem a chave do cache.
+    """
+    from src.exporter import create_interactive_map
+    return create_interactive_map(_df, _geojson)
+
+def _prune_static_maps(keep: int = MAP_STATIC_KEEP) -> None:
+    """Apaga os mapas mais antigos de `static/`, mantendo os `keep` gravados por último."""
+    try:
+        maps = sorted(MAP_STATIC_DIR.glob("route_*.html"), key=lambda path: path.stat().st_mtime, reverse=True)
+        for old_map in maps[keep:]:
+            old_map.unlink(missing_ok=True)
+    except OSError as e:
+        print(f"ERRO ao apagar mapas antigos: {e}")
+
+def publish_map_html(df_signature: bytes, geojson_json: str, map_html: str):
+    """
+    Grava o HTML do mapa em `static/` com nome derivado do conteúdo e retorna a
+    URL relativa para o iframe. O arquivo só é escrito quando a rota muda, e
+    cada gravação apaga os mapas mais antigos além de MAP_STATIC_KEEP.
+    Retorna None se o serviço de arquivos estáticos estiver desativado ou falhar.
+    """
+    if not st.get_option("server.enableStaticServing"):
+        return None
+    digest = hashlib.blake2b(df_signature + geojson_json.encode(), digest_size=16).hexdigest()
+    file_name = f"route_{digest}.html"
+    map_path = MAP_STATIC_DIR / file_name
+    try:
+        if not map_path.exists():
+            MAP_STATIC_DIR.mkdir(exist_ok=True)
+            map_path.write_text(map_html, encoding="utf-8")
+            _prune_static_maps()
+    except OSError as e:
+        print(f"ERRO ao gravar o mapa em arquivo estático: {e}")
+        return None
+    return f"app/static/{file_name}"
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _cached_exports(df_signature: bytes, _df: pd.DataFrame) -> dict:
+    """
+    Serializa a rota otimizada em todos os formatos de exportação, uma vez por rota.
+    Tudo fica em bytes para o st.download_button não recodificar texto a cada rerun.
+    """
+    from src.exporter import export_to_csv, export_to_geojson, export_to_kml, export_to_gpx, export_to_mymaps_csv
+    return {
+        "csv": export_to_csv(_df),
+        "geojson": export_to_geojson(_df),
+        "kml": export_to_kml(_df),
+        "gpx": export_to_gpx(_df).encode("utf-8"),
+        "mymaps": export_to_mymaps_csv(_df),
+    }
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _cached_gmaps_links(df_signature: bytes, _df: pd.DataFrame) -> list:
+    """Monta os links de navegação do Google Maps uma vez por rota otimizada."""
+    from src.exporter import generate_google_maps_links
+    return generate_google_maps_links(_df)
+
+def _route_cache_key(df: pd.DataFrame, start_node: int, end_node: int) -> str:
+    """Gera uma chave única para o conjunto de coordenadas e os nós de partida/chegada."""
+    coords = np.ascontiguousarray(df[['Latitude', 'Longitude']].to_numpy(np.float64))
+    return hashlib.blake2b(coords.tobytes() + f"{start_node}:{end_node}".encode(), digest_size=16).hexdigest()
+
+@st.cache_data(show_spinner=False, max_entries=ROUTE_CACHE_ENTRIES)
+def _solve_offline_cached(route_key: str, _df: pd.DataFrame, start_node: int, end_node: int) -> list:
+    """Ordem de visita calculada pelo OR-Tools, memorizada pelas coordenadas e nós."""
+    from src.optimizer import solve_route_order
+    route_indices = solve_route_order(_df, start_node, end_node)
+    if route_indices is None:
+        raise _UncachedResult(None)
+    return route_indices
+
+def optimize_offline(df: pd.DataFrame, start_node: int, end_node: int) -> pd.DataFrame:
+    """
+    Otimiza a rota com o OR-Tools, reaproveitando a ordem já calculada quando
+    o mesmo conjunto de pontos é otimizado novamente.
+    """
+    if len(df) <= 2:
+        return df
+
+    try:
+        route_indices = _solve_offline_cached(_route_cache_key(df, start_node, end_node), df, start_node, end_node)
+    except _UncachedResult:
+        return df
+    return df.iloc[route_indices].reset_index(drop=True)
+
+@st.cache_data(show_spinner=False, max_entries=ROUTE_CACHE_ENTRIES)
+def _optimize_online_cached(df_signature: bytes, key_digest: bytes, start_node: int, end_node: int, _df: pd.DataFrame, _api_key: str) -> dict:
+    """
+    Resultado da otimização online (ordem, GeoJSON, distância e duração),
+    memorizado pelo conteúdo completo da tabela, nós e hash da chave da API.
+    """
+    result = optimize_route_online(_df, _api_key, start_node=start_node, end_node=end_node)
+    if not result:
+        raise _UncachedResult(None)
+    return result
+
+def optimize_online(df: pd.DataFrame, api_key: str, start_node: int, end_node: int):
+    """Otimiza a rota com o ORS, sem repetir a chamada para uma rota idêntica."""
+    key_digest = hashlib.blake2b(api_key.encode(), digest_size=8).digest()
+    try:
+        return _optimize_online_cached(_dataframe_signature(df), key_digest, start_node, end_node, df, api_key)
+    except _UncachedResult:
+        return None
+
+@st.cache_resource
+def _ai_table_results() -> tuple:
+    """
+    LRU (e sua trava) com os resultados das ferramentas de IA, compartilhado
+    entre sessões. Não usa st.cache_data porque as funções do Gemini desenham a
+    barra de progresso e a mensagem de sucesso, que o cache repetiria a cada acerto.
+    """
+    return OrderedDict(), threading.Lock()
+
+def _ai_result_is_complete(tool: str, df: pd.DataFrame, result: pd.DataFrame) -> bool:
+    """
+    Só resultados completos são guardados: no enriquecimento, sem lotes que
+    falharam; na padronização, diferente da entrada (se todos os lotes falharam
+    ou nada mudou, um novo clique deve tentar de novo).
+    """
+    if tool == "enrich":
+        from src.gemini_services import ENRICH_BATCH_ERROR
+        return not (result['Endereço'] == ENRICH_BATCH_ERROR).any()
+    return _dataframe_signature(result) != session_signature(df)
+
+def run_ai_table_tool(tool: str, df: pd.DataFrame, api_key: str) -> pd.DataFrame:
+    """
+    Executa a ferramenta de IA que altera a tabela ("enrich" ou "standardize"),
+    devolvendo o resultado memorizado quando a mesma tabela já foi processada
+    com a mesma chave.
+    """
+    from src.gemini_services import enrich_data_with_gemini, standardize_names_with_gemini
+
+    key = (tool, session_signature(df), hashlib.blake2b(api_key.encode(), digest_size=8).digest())
+    results, lock = _ai_table_results()
+    with lock:
+        cached = results.get(key)
+        if cached is not None:
+            results.move_to_end(key)
+    if cached is not None:
+        return cached.copy()
+
+    tool_func = enrich_data_with_gemini if tool == "enrich" else standardize_names_with_gemini
+    result = tool_func(df, api_key)
+    if _ai_result_is_complete(tool, df, result):
+        with lock:
+            results[key] = result.copy()
+            if len(results) > AI_TABLE_RESULT_ENTRIES:
+                results.popitem(last=False)
+    return result
+
+def _grid_schema_key(df: pd.DataFrame) -> tuple:
+    """Chave do esquema do grid: nomes das colunas seguidos dos seus tipos."""
+    return tuple(df.columns) + tuple(df.dtypes.astype(str))
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def _build_grid_options(schema_key: tuple, has_rows: bool) -> dict:
+    """
+    Monta as opções do AgGrid para um esquema de colunas. O resultado depende
+    apenas dos nomes/tipos das colunas, então é reaproveitado entre execuções.
+    O dicionário é compartilhado: quem for entregá-lo ao AgGrid (que o ajusta)
+    deve usar uma cópia. st.cache_resource porque o resultado não é serializável.
+    """
+    n_columns = len(schema_key) // 2
+    columns, dtypes = schema_key[:n_columns], schema_key[n_columns:]
+    schema_df = pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in zip(columns, dtypes)})
+
+    from st_aggrid import GridOptionsBuilder, JsCode
+
+    gb = GridOptionsBuilder.from_dataframe(schema_df)
+    gb.configure_default_column(editable=True, groupable=True)
+    # Só as linhas visíveis (mais um buffer) são desenhadas; sem animação ao reordenar.
+    gb.configure_grid_options(rowDragManaged=True, rowBuffer=20, animateRows=False)
+    gb.configure_selection(selection_mode='multiple', use_checkbox=True, header_checkbox=True)
+
+    # Larguras fixas pelo tamanho do cabeçalho evitam o ajuste de colunas na carga.
+    for col in columns:
+        gb.configure_column(col, width=GRID_COLUMN_WIDTHS.get(col, max(110, 10 * len(str(col)) + 50)))
+
+    if has_rows and columns:
+        gb.configure_column(columns[0], rowDrag=True)
+
+    if 'Latitude' in columns and 'Longitude' in columns:
+        # Coluna virtual: não existe no DataFrame e não volta na resposta do grid.
+        gb.configure_column(
+            "Google Maps", valueGetter="data.Latitude + ',' + data.Longitude",
+            cellRenderer=JsCode(LINK_RENDERER_JS), editable=False, width=130
+        )
+
+    return gb.build()
+
+def empty_points_frame() -> pd.DataFrame:
+    """DataFrame vazio de pontos, já com as colunas de coordenadas tipadas."""
+    return pd.DataFrame({col: pd.Series(dtype=POINT_DTYPES.get(col, object)) for col in POINT_COLUMNS})
+
+def queue_new_point(name: str, lat: float, lon: float):
+    """Guarda um novo ponto no buffer da sessão, sem reconstruir o DataFrame."""
+    st.session_state.points_buffer.append({'Nome': name, 'Latitude': lat, 'Longitude': lon})
+
+def flush_points_buffer():
+    """
+    Incorpora os pontos pendentes do buffer em `processed_data` com um único concat.
+    """
+    buffer = st.session_state.points_buffer
+    if not buffer or st.session_state.processed_data is None:
+        return
+    new_rows = pd.DataFrame.from_records(buffer, columns=POINT_COLUMNS).astype(POINT_DTYPES)
+    st.session_state.processed_data = pd.concat([st.session_state.processed_data, new_rows], ignore_index=True)
+    st.session_state.points_buffer = []
+
 def handle_processed_result(result: dict):
     """
     Função central para lidar com o resultado do processamento de dados.
@@ -69,8 +518,11 @@ def handle_processed_result(result: dict):
 
     status = result.get('status')
     if status == 'success':
-        df = result['data']
-        st.session_state.processed_data = add_maps_link_column(df)
+        df, removed = drop_duplicate_points(result['data'].drop(columns='Google Maps', errors='ignore'))
+        st.session_state.processed_data = df
+        if removed:
+            # Exibido na seção de adicionar pontos, após o rerun.
+            st.session_state.add_point_feedback = ("info", f"Removidos {removed} ponto(s) duplicado(s) (mesmas coordenadas e mesmo nome).")
         st.session_state.manual_mapping_required = False
         st.session_state.show_divergence_screen = False
         st.success(result.get('message', "Dados processados com sucesso!"))
@@ -124,13 +576,16 @@ def draw_sidebar():
             clear_session()
         
         if st.session_state.processed_data is not None:
+            flush_points_buffer()
             st.markdown("---")
             st.subheader("Gerir Sessão")
             
             if not st.session_state.processed_data.empty:
                 st.download_button(
                     label="Salvar Sessão de Trabalho",
-                    data=st.session_state.processed_data.to_csv(index=False).encode('utf-8-sig'),
+                    data=_serialize_session_csv(
+                        session_signature(st.session_state.processed_data), st.session_state.processed_data
+                    ),
                     file_name="sessao_otimizador.csv",
                     mime="text/csv",
                     use_container_width=True
@@ -143,8 +598,13 @@ def draw_sidebar():
                 help="Esta funcionalidade está em manutenção e será reativada em breve."
             )
 
+@st.fragment
 def draw_ai_tools_section():
-    """Desenha a seção com as ferramentas de IA."""
+    """Desenha a seção com as ferramentas de IA.
+
+    Roda como fragmento: digitar a senha não recarrega o app. Quando a IA altera
+    os pontos, o st.rerun() recarrega o app inteiro para o grid refletir a mudança.
+    """
     api_keys = st.session_state.api_keys
     GEMINI_API_KEY = api_keys.get("GEMINI_API_KEY")
 
@@ -157,35 +617,95 @@ def draw_ai_tools_section():
         with col1:
             if st.button("Enriquecer Dados", use_container_width=True, help="Adiciona Endereço e Categoria aos pontos."):
                 if check_ai_password():
-                    updated_df = enrich_data_with_gemini(st.session_state.processed_data, GEMINI_API_KEY)
+                    updated_df = run_ai_table_tool("enrich", st.session_state.processed_data, GEMINI_API_KEY)
                     st.session_state.processed_data = updated_df
                     st.rerun()
         
         with col2:
             if st.button("Padronizar Nomes", use_container_width=True, help="Corrige abreviações e erros de digitação nos nomes."):
                 if check_ai_password():
-                    updated_df = standardize_names_with_gemini(st.session_state.processed_data, GEMINI_API_KEY)
+                    updated_df = run_ai_table_tool("standardize", st.session_state.processed_data, GEMINI_API_KEY)
                     st.session_state.processed_data = updated_df
                     st.rerun()
         with col3:
             if st.button("Verificar Duplicatas", use_container_width=True, help="Analisa a lista em busca de pontos duplicados."):
                  if check_ai_password():
+                    from src.gemini_services import find_duplicates_with_gemini
                     find_duplicates_with_gemini(st.session_state.processed_data, GEMINI_API_KEY)
 
+        # Só consulta as estatísticas se o módulo já foi carregado por alguma ferramenta.
+        gemini_services = sys.modules.get("src.gemini_services")
+        if gemini_services is not None:
+            stats = gemini_services.get_gemini_cache_stats()
+            if stats["hits"] or stats["misses"]:
+                st.caption(f"Cache da IA: {stats['hits']} resposta(s) reaproveitada(s), {stats['misses']} chamada(s) à API.")
+
+def _use_suggestion(suggestion: str):
+    """Callback: copia a sugestão escolhida para o campo de endereço."""
+    st.session_state.address_input = suggestion
+
+def _add_point_from_text(api_key: str):
+    """
+    Callback do botão "Adicionar Ponto". Roda antes da nova execução do script,
+    então pode limpar o campo de endereço diretamente, sem flag nem rerun extra.
+    """
+    text_input = st.session_state.address_input
+    with st.spinner("Analisando entrada..."):
+        coords = extract_coords_from_text(text_input)
+        if not coords:
+            if not api_key:
+                st.session_state.add_point_feedback = ("error", "A chave da API do OpenRouteService é necessária para buscar endereços.")
+                return
+            coords = cached_geocode(text_input, api_key)
+
+    if coords:
+        lat, lon = coords
+        queue_new_point(text_input, lat, lon)
+        st.session_state.address_input = ""
+        st.session_state.add_point_feedback = ("success", "Ponto adicionado com sucesso.")
+    else:
+        st.session_state.add_point_feedback = ("error", "Não foi possível encontrar coordenadas para a entrada fornecida.")
+
+def add_points_from_lines(lines: list, api_key: str) -> list:
+    """
+    Adiciona vários pontos de uma vez (um endereço, link ou coordenada por
+    linha). Entradas sem coordenadas explícitas são geocodificadas em paralelo.
+    Retorna as linhas que não puderam ser localizadas.
+    """
+    coords = [extract_coords_from_text(line) for line in lines]
+    pending = [i for i, c in enumerate(coords) if c is None]
+    if pending and api_key:
+        for i, result in zip(pending, geocode_many([lines[i] for i in pending], api_key)):
+            coords[i] = result
+
+    not_found = []
+    for line, point in zip(lines, coords):
+        if point:
+            queue_new_point(line, point[0], point[1])
+        else:
+            not_found.append(line)
+    return not_found
+
+@st.fragment
 def draw_add_point_section():
-    """Desenha a seção para adicionar um novo ponto à rota."""
+    """Desenha a seção para adicionar um novo ponto à rota.
+
+    Roda como fragmento: digitar, trocar o método e usar as sugestões só
+    recarrega esta seção. Os pontos novos ficam no buffer e exigem um rerun do
+    app inteiro, que descarrega o buffer antes de desenhar o grid.
+    """
+    if st.session_state.points_buffer:
+        # Um callback (ex.: "Adicionar Ponto") enfileirou pontos neste rerun do fragmento.
+        st.rerun()
+
     st.markdown("---")
     st.subheader("Adicionar Novo Ponto")
 
-    ORS_API_KEY = st.session_state.api_keys.get("ORS_API_KEY")
-
-    if st.session_state.clear_address_input_flag:
-        st.session_state.address_input = ""
-        st.session_state.clear_address_input_flag = False
+    ORS_API_KEY = st.session_state.ors_api_key
 
     add_mode = st.radio(
         "Método de adição:",
-        ("Por Endereço / Link", "Por Coordenadas"),
+        ("Por Endereço / Link", "Por Coordenadas", "Vários Endereços"),
         horizontal=True,
         label_visibility="collapsed"
     )
@@ -194,41 +714,29 @@ def draw_add_point_section():
         text_input = st.text_input(
             "Digite um endereço, link do Google Maps ou Plus Code",
             placeholder="Ex: Av. Paulista, 1578 ou https://maps.app.goo.gl/...",
-            key="address_input"
+            key="address_input",
+            on_change=_schedule_autocomplete
         )
         
         suggestions_container = st.container()
 
-        if text_input and "http" not in text_input and not re.search(r"-?\d+\.\d+", text_input):
-             if len(text_input) > 3 and ORS_API_KEY:
-                suggestions = autocomplete_address(text_input, ORS_API_KEY)
+        if text_input and not text_input.lstrip().startswith(("http://", "https://")) and not DECIMAL_RE.search(text_input):
+             if len(text_input) >= AUTOCOMPLETE_MIN_CHARS and ORS_API_KEY:
+                _advance_autocomplete(text_input.strip(), ORS_API_KEY)
+                if _autocomplete_waiting():
+                    _poll_autocomplete(text_input.strip(), ORS_API_KEY)
+                suggestions = st.session_state.autocomplete_suggestions
                 with suggestions_container:
                     for suggestion in suggestions[:3]:
-                        if st.button(suggestion, key=f"sug_{suggestion}", use_container_width=True):
-                            st.session_state.address_input = suggestion
-                            st.rerun()
-
-        if st.button("Adicionar Ponto", key="add_by_text", disabled=not text_input):
-            with st.spinner("Analisando entrada..."):
-                coords = extract_coords_from_text(text_input)
-                point_name = text_input
-                
-                if not coords:
-                    if not ORS_API_KEY:
-                        st.error("A chave da API do OpenRouteService é necessária para buscar endereços.")
-                        return
-                    coords = geocode_address(text_input, ORS_API_KEY)
-                
-                if coords:
-                    lat, lon = coords
-                    new_row = pd.DataFrame([{'Nome': point_name, 'Latitude': lat, 'Longitude': lon}])
-                    df_updated = pd.concat([st.session_state.processed_data, new_row], ignore_index=True)
-                    st.session_state.processed_data = add_maps_link_column(df_updated)
-                    st.session_state.clear_address_input_flag = True
-                    st.success("Ponto adicionado com sucesso.")
-                    st.rerun()
-                else:
-                    st.error("Não foi possível encontrar coordenadas para a entrada fornecida.")
+                        st.button(
+                            suggestion, key=f"sug_{suggestion}", use_container_width=True,
+                            on_click=_use_suggestion, args=(suggestion,)
+                        )
+
+        st.button(
+            "Adicionar Ponto", key="add_by_text", disabled=not text_input,
+            on_click=_add_point_from_text, args=(ORS_API_KEY,)
+        )
 
     elif add_mode == "Por Coordenadas":
         st.markdown("**Opção 1: Campos Separados**")
@@ -268,19 +776,44 @@ def draw_add_point_section():
                 return
 
             point_name = name or f"Ponto {lat:.4f}, {lon:.4f}"
-            new_row = pd.DataFrame([{'Nome': point_name, 'Latitude': lat, 'Longitude': lon}])
-            df_updated = pd.concat([st.session_state.processed_data, new_row], ignore_index=True)
-            st.session_state.processed_data = add_maps_link_column(df_updated)
+            queue_new_point(point_name, lat, lon)
             st.success(f"Ponto '{point_name}' adicionado.")
             st.rerun()
 
+    elif add_mode == "Vários Endereços":
+        bulk_text = st.text_area(
+            "Cole um endereço, link ou coordenada por linha",
+            placeholder="Av. Paulista, 1578\nPraça da Liberdade, Belo Horizonte\n-19.842761, -43.351048",
+            key="bulk_address_input"
+        )
+        lines = [line.strip() for line in bulk_text.splitlines() if line.strip()]
+
+        if st.button("Adicionar Todos", key="add_bulk", disabled=not lines):
+            with st.spinner(f"Localizando {len(lines)} entrada(s)..."):
+                not_found = add_points_from_lines(lines, ORS_API_KEY)
+            added = len(lines) - len(not_found)
+            if not_found:
+                st.session_state.add_point_feedback = (
+                    "error",
+                    f"{added} ponto(s) adicionado(s). Não foi possível encontrar coordenadas para: " + "; ".join(not_found)
+                )
+            else:
+                st.session_state.add_point_feedback = ("success", f"{added} ponto(s) adicionado(s).")
+            st.rerun()
+
+    feedback = st.session_state.add_point_feedback
+    if feedback:
+        level, message = feedback
+        getattr(st, level)(message)
+        st.session_state.add_point_feedback = None
+
 
 def draw_optimization_controls():
     """Desenha os botões e a lógica para executar a otimização."""
     st.markdown("---")
     st.subheader("Executar Otimização")
 
-    ORS_API_KEY = st.session_state.api_keys.get("ORS_API_KEY")
+    ORS_API_KEY = st.session_state.ors_api_key
     if not ORS_API_KEY:
         st.warning("Chave da API do OpenRouteService não encontrada. A otimização online está desabilitada.")
 
@@ -293,7 +826,9 @@ def draw_optimization_controls():
 
     if custom_start_end and len(st.session_state.processed_data) > 1:
         df_data = st.session_state.processed_data
-        point_options = [f"{idx}: {row.get('Nome', f'Ponto {idx+1}')}" for idx, row in df_data.iterrows()]
+        default_names = pd.Series([f'Ponto {pos+1}' for pos in range(len(df_data))], index=df_data.index)
+        names = df_data['Nome'].fillna(default_names) if 'Nome' in df_data.columns else default_names
+        point_options = [f"{pos}: {name}" for pos, name in enumerate(names.astype(str))]
         
         col1, col2 = st.columns(2)
         start_point_str = col1.selectbox("Ponto de Partida", options=point_options, index=0)
@@ -309,8 +844,10 @@ def draw_optimization_controls():
     with col1:
         if st.button("Otimizar Rota (Offline)", use_container_width=True, help="Mais rápido, usa distância em linha reta."):
             if len(st.session_state.processed_data) > 1:
-                with st.spinner("Otimizando rota com OR-Tools..."):
-                    optimized_df = ortools_optimizer(st.session_state.processed_data.copy(), start_node=start_node, end_node=end_node)
+                from src.optimizer import search_time_limit
+                max_seconds = search_time_limit(len(st.session_state.processed_data))
+                with st.spinner(f"Otimizando rota com OR-Tools (pode levar até {max_seconds} s)..."):
+                    optimized_df = optimize_offline(st.session_state.processed_data, start_node=start_node, end_node=end_node)
                     st.session_state.optimized_data = add_maps_link_column(optimized_df)
                     st.session_state.route_geojson = None
                     st.session_state.total_distance = None
@@ -323,7 +860,7 @@ def draw_optimization_controls():
         if st.button("Otimizar Rota (Online)", use_container_width=True, type="primary", help="Mais preciso, usa ruas reais.", disabled=(not ORS_API_KEY)):
             if len(st.session_state.processed_data) > 1:
                 with st.spinner("Otimizando rota com a API OpenRouteService..."):
-                    result = optimize_route_online(st.session_state.processed_data.copy(), ORS_API_KEY, start_node=start_node, end_node=end_node)
+                    result = optimize_online(st.session_state.processed_data, ORS_API_KEY, start_node=start_node, end_node=end_node)
                     if result:
                         st.session_state.optimized_data = add_maps_link_column(result["data"])
                         st.session_state.route_geojson = result["geojson"]
@@ -335,10 +872,10 @@ def draw_optimization_controls():
             else:
                 st.warning("São necessários pelo menos 2 pontos para otimizar.")
 
-def draw_gmaps_links_section():
+def draw_gmaps_links_section(df_signature: bytes):
     """Desenha a seção com os links de navegação do Google Maps."""
     st.subheader("Navegar com Google Maps")
-    gmaps_links = generate_google_maps_links(st.session_state.optimized_data)
+    gmaps_links = _cached_gmaps_links(df_signature, st.session_state.optimized_data)
     
     if not gmaps_links:
         st.info("Não há pontos suficientes para gerar um link de navegação.")
@@ -353,8 +890,13 @@ def draw_gmaps_links_section():
             end_point_num = min((i * 9) + 10, len(st.session_state.optimized_data))
             st.markdown(f'**Parte {i+1} (Pontos {start_point_num}–{end_point_num}):** <a href="{link}" target="_blank">Abrir no Google Maps</a>', unsafe_allow_html=True)
 
+@st.fragment
 def draw_results_section():
-    """Desenha a seção de resultados se uma rota otimizada existir."""
+    """
+    Desenha a seção de resultados se uma rota otimizada existir.
+    Fragmento aninhado em `draw_route_outputs`: os downloads só recarregam os
+    resultados, sem refazer os controles de otimização nem o grid.
+    """
     if st.session_state.optimized_data is not None:
         st.markdown("---")
         st.header("3. Resultados da Otimização")
@@ -366,27 +908,45 @@ def draw_results_section():
             col1.metric("Distância Total", f"{st.session_state.total_distance:.2f} km")
             col2.metric("Duração Estimada", f"{st.session_state.total_duration:.1f} min")
 
-        with st.spinner("Gerando mapa..."):
-            map_html = create_interactive_map(st.session_state.optimized_data, st.session_state.route_geojson)
-            if map_html:
-                st.components.v1.html(map_html, height=600)
+        df_opt = st.session_state.optimized_data
+        route_geojson = st.session_state.route_geojson
+        df_signature = session_signature(df_opt)
+
+        # Serializar o GeoJSON e consultar os caches só acontece quando a rota muda
+        # ou o arquivo do mapa sumiu de `static/`; nos demais reruns o iframe
+        # reaproveita a mesma URL (ou o mesmo HTML).
+        memo = st.session_state.map_embed_memo
+        if (memo is None or memo[0] != df_signature or memo[1] is not route_geojson
+                or (memo[2] and not (MAP_STATIC_DIR / memo[2].rsplit("/", 1)[-1]).exists())):
+            with st.spinner("Gerando mapa..."):
+                geojson_json = json.dumps(route_geojson, sort_keys=True)
+                map_html = _cached_map_html(df_signature, geojson_json, df_opt, route_geojson)
+                map_url = publish_map_html(df_signature, geojson_json, map_html) if map_html else None
+            memo = (df_signature, route_geojson, map_url, None if map_url else map_html)
+            st.session_state.map_embed_memo = memo
+
+        map_url, map_html = memo[2], memo[3]
+        if map_url:
+            st.components.v1.iframe(map_url, height=600)
+        elif map_html:
+            st.components.v1.html(map_html, height=600)
         
-        draw_gmaps_links_section()
+        draw_gmaps_links_section(df_signature)
         
         st.subheader("Exportar Resultados")
         c1, c2, c3, c4, c5 = st.columns(5)
-        df_opt = st.session_state.optimized_data
+        exports = _cached_exports(df_signature, df_opt)
         
         with c1:
-            st.download_button("Exportar CSV", export_to_csv(df_opt), "rota_otimizada.csv", use_container_width=True)
+            st.download_button("Exportar CSV", exports["csv"], "rota_otimizada.csv", use_container_width=True)
         with c2:
-            st.download_button("Exportar GeoJSON", export_to_geojson(df_opt), "rota_otimizada.geojson", use_container_width=True)
+            st.download_button("Exportar GeoJSON", exports["geojson"], "rota_otimizada.geojson", use_container_width=True)
         with c3:
-            st.download_button("Exportar KML", export_to_kml(df_opt), "rota_otimizada.kml", use_container_width=True)
+            st.download_button("Exportar KML", exports["kml"], "rota_otimizada.kml", use_container_width=True)
         with c4:
-            st.download_button("Exportar GPX", export_to_gpx(df_opt), "rota_otimizada.gpx", use_container_width=True)
+            st.download_button("Exportar GPX", exports["gpx"], "rota_otimizada.gpx", use_container_width=True)
         with c5:
-            st.download_button("Para My Maps", export_to_mymaps_csv(df_opt), "rota_para_mymaps.csv", use_container_width=True)
+            st.download_button("Para My Maps", exports["mymaps"], "rota_para_mymaps.csv", use_container_width=True)
 
 def draw_manual_mapping_screen():
     """Desenha a tela para o usuário mapear as colunas manualmente."""
@@ -406,8 +966,8 @@ def draw_manual_mapping_screen():
     name_col = col3.selectbox("Selecione a coluna de Nome (Opcional)", options=options, key="name_col_sep")
 
     st.markdown("---")
-    st.markdown("**Opção 2: Extrair de uma única coluna (links ou coordenadas juntas)**")
-    single_col = st.selectbox("Selecione a coluna que contém as coordenadas ou links", options=options, key="single_col")
+    st.markdown("**Opção 2: Extrair de uma única coluna (links, coordenadas juntas ou endereços)**")
+    single_col = st.selectbox("Selecione a coluna que contém as coordenadas, links ou endereços", options=options, key="single_col")
 
     if st.button("Aplicar Mapeamento e Continuar"):
         df_mapped = df_raw.copy()
@@ -419,12 +979,23 @@ def draw_manual_mapping_screen():
             df_mapped.rename(columns=rename_dict, inplace=True)
 
         elif single_col:
-            coords_series = df_mapped[single_col].dropna().astype(str).apply(extract_coords_from_text)
-            if coords_series.dropna().empty:
+            values = df_mapped[single_col].dropna()
+            coords_df = extract_coords_from_series(values)
+            missing = coords_df['Latitude'].isna().to_numpy()
+            ORS_API_KEY = st.session_state.ors_api_key
+            if missing.any() and ORS_API_KEY:
+                # Linhas sem coordenadas explícitas são tratadas como endereços.
+                addresses = values[missing].astype(str).tolist()
+                with st.spinner(f"Geocodificando {len(addresses)} endereço(s)..."):
+                    results = geocode_many(addresses, ORS_API_KEY)
+                coords_df.loc[missing, ['Latitude', 'Longitude']] = [
+                    point if point else (np.nan, np.nan) for point in results
+                ]
+            coords_df = coords_df.dropna()
+            if coords_df.empty:
                 st.error("Nenhuma coordenada válida encontrada na coluna selecionada.")
                 return
             
-            coords_df = pd.DataFrame(coords_series.dropna().tolist(), index=coords_series.dropna().index, columns=['Latitude', 'Longitude'])
             df_mapped = df_mapped.join(coords_df)
             
             if not name_col:
@@ -442,7 +1013,7 @@ def draw_manual_mapping_screen():
 
         df_cleaned = clean_data(df_mapped)
         if not df_cleaned.empty:
-            st.session_state.processed_data = add_maps_link_column(df_cleaned)
+            st.session_state.processed_data = df_cleaned.astype(POINT_DTYPES)
             st.session_state.manual_mapping_required = False
             st.session_state.raw_data_for_mapping = None
             st.success(f"Mapeamento aplicado! {len(df_cleaned)} pontos válidos encontrados.")
@@ -488,12 +1059,96 @@ def draw_divergence_resolution_screen():
                     df.at[index, 'Latitude'] = divergence_item['coords_link'][0]
                     df.at[index, 'Longitude'] = divergence_item['coords_link'][1]
             
-            st.session_state.processed_data = add_maps_link_column(df)
+            st.session_state.processed_data = df
             st.session_state.divergence_data = None
             st.session_state.show_divergence_screen = False
             st.success("Divergências resolvidas com sucesso!")
             st.rerun()
 
+def _keep_mask(df: pd.DataFrame, selected_rows) -> np.ndarray:
+    """
+    Máscara booleana das linhas que continuam após apagar a seleção do grid.
+
+    O st_aggrid 1.x devolve as linhas selecionadas num DataFrame indexado pelo
+    id estável que ele atribui a cada linha enviada (a posição, em texto). O
+    DataFrame devolvido pelo grid usa o mesmo id como índice, e o da sessão tem
+    índice 0..n-1; comparar os rótulos em texto acerta nos dois casos, mesmo
+    depois de arrastar linhas. Versões antigas devolvem uma lista de dicts com
+    a posição em `_selectedRowNodeInfo`.
+    """
+    if isinstance(selected_rows, pd.DataFrame):
+        return ~df.index.astype(str).isin(selected_rows.index.astype(str))
+
+    keep_mask = np.ones(len(df), dtype=bool)
+    keep_mask[np.fromiter(
+        (row['_selectedRowNodeInfo']['nodeRowIndex'] for row in selected_rows),
+        dtype=np.intp, count=len(selected_rows)
+    )] = False
+    return keep_mask
+
+@st.fragment
+def draw_route_editor():
+    """Desenha o grid editável dos pontos e o botão de apagar a seleção.
+
+    Roda como fragmento: selecionar ou editar linhas não redesenha o mapa nem os
+    resultados. Apagar pontos recarrega o app inteiro, pois muda as opções de
+    início/fim da otimização.
+    """
+    st.markdown("Arraste as linhas para reordenar, clique duas vezes para editar e use as caixas de seleção para apagar pontos.")
+    
+    from st_aggrid import AgGrid, GridUpdateMode, DataReturnMode
+
+    df_for_grid = st.session_state.processed_data
+    if not df_for_grid.index.equals(pd.RangeIndex(len(df_for_grid))):
+        df_for_grid = df_for_grid.reset_index(drop=True)
+        st.session_state.processed_data = df_for_grid
+    grid_key = (_grid_schema_key(df_for_grid), not df_for_grid.empty)
+    memo = st.session_state.grid_options_memo
+    if memo is None or memo[0] != grid_key:
+        memo = (grid_key, copy.deepcopy(_build_grid_options(*grid_key)))
+        st.session_state.grid_options_memo = memo
+    grid_options = memo[1]
+
+    # O AgGrid acrescenta uma coluna interna ao DataFrame recebido; a cópia rasa
+    # mantém a tabela da sessão intacta.
+    ag_grid_response = AgGrid(
+        df_for_grid.copy(deep=False),
+        gridOptions=grid_options,
+        update_mode=GridUpdateMode.MODEL_CHANGED,
+        data_return_mode=DataReturnMode.AS_INPUT,
+        allow_unsafe_jscode=True,    
+        height=400,
+        key='editable_grid'
+    )
+    
+    # O AgGrid sempre devolve um DataFrame novo (com o grid vazio, JSON em texto).
+    # A tabela da sessão só é trocada quando o conteúdo realmente mudou, para não
+    # invalidar a assinatura memorizada nem os caches que dependem dela.
+    grid_data = ag_grid_response['data']
+    if isinstance(grid_data, pd.DataFrame) and _dataframe_signature(grid_data) != session_signature(df_for_grid):
+        st.session_state.processed_data = grid_data
+    
+    selected_rows = ag_grid_response['selected_rows']
+    selected_count = 0 if selected_rows is None else len(selected_rows)
+    if st.button("Apagar Pontos Selecionados", disabled=not selected_count):
+        df_current = st.session_state.processed_data
+        st.session_state.processed_data = df_current.iloc[_keep_mask(df_current, selected_rows)]
+        st.success(f"{selected_count} ponto(s) apagado(s).")
+        st.rerun()
+
+
+@st.fragment
+def draw_route_outputs():
+    """Desenha os controles de otimização e os resultados num mesmo fragmento.
+
+    Os resultados são desenhados logo após os controles, então otimizar não
+    precisa de st.rerun(); os seletores de início/fim também só recarregam
+    este fragmento.
+    """
+    draw_optimization_controls()
+    draw_results_section()
+
+
 def draw_main_content():
     """Desenha o conteúdo principal da página, que muda conforme o estado."""
     
@@ -519,7 +1174,7 @@ def draw_main_content():
             )
             if spreadsheet_file:
                 with st.spinner("Analisando e processando sua planilha..."):
-                    result = process_uploaded_file(spreadsheet_file)
+                    result = run_cached_processing('file', spreadsheet_file)
                     handle_processed_result(result)
 
         with tab2:
@@ -530,98 +1185,64 @@ def draw_main_content():
             )
             if gps_file:
                 with st.spinner("Analisando e processando seu arquivo de GPS..."):
-                    result = process_uploaded_file(gps_file)
+                    result = run_cached_processing('file', gps_file)
                     handle_processed_result(result)
         
         with tab3:
             st.markdown("Adicione seus pontos um por um, manualmente.")
             if st.button("Começar Rota Manual", use_container_width=True):
-                st.session_state.processed_data = add_maps_link_column(pd.DataFrame(columns=['Nome', 'Latitude', 'Longitude']))
+                st.session_state.processed_data = empty_points_frame()
                 st.rerun()
 
         with tab4:
             st.markdown("Cole um link compartilhável do seu mapa no Google My Maps.")
-            mymaps_url = st.text_input("URL do Google My Maps", label_visibility="collapsed", key="mymaps_url")
-            if st.button("Processar Link do My Maps", use_container_width=True, disabled=not mymaps_url):
-                with st.spinner("Extraindo pontos do My Maps..."):
-                    result = process_mymaps_link(mymaps_url)
-                    handle_processed_result(result)
+            # Dentro de um formulário o valor só é enviado (e o app só recarrega) no botão.
+            with st.form("mymaps_form", border=False):
+                mymaps_url = st.text_input("URL do Google My Maps", label_visibility="collapsed", key="mymaps_url")
+                submitted = st.form_submit_button("Processar Link do My Maps", use_container_width=True)
+            if submitted:
+                if not mymaps_url:
+                    st.warning("Cole o link do My Maps antes de processar.")
+                else:
+                    with st.spinner("Extraindo pontos do My Maps..."):
+                        result = run_cached_processing('mymaps', mymaps_url)
+                        handle_processed_result(result)
         
         with tab5:
             st.markdown("Cole um link compartilhável de um arquivo CSV ou XLSX do Google Drive.")
-            drive_url = st.text_input("URL do Google Drive", label_visibility="collapsed", key="drive_url")
-            if st.button("Processar Link do Drive", use_container_width=True, disabled=not drive_url):
-                with st.spinner("Baixando e processando arquivo do Google Drive..."):
-                    result = process_drive_link(drive_url)
-                    handle_processed_result(result)
+            with st.form("drive_form", border=False):
+                drive_url = st.text_input("URL do Google Drive", label_visibility="collapsed", key="drive_url")
+                submitted = st.form_submit_button("Processar Link do Drive", use_container_width=True)
+            if submitted:
+                if not drive_url:
+                    st.warning("Cole o link do Google Drive antes de processar.")
+                else:
+                    with st.spinner("Baixando e processando arquivo do Google Drive..."):
+                        result = run_cached_processing('drive', drive_url)
+                        handle_processed_result(result)
 
         with tab6:
             st.markdown("Copie os dados de uma planilha (formato CSV) e cole abaixo.")
-            text_data = st.text_area("Cole os dados aqui", height=200, label_visibility="collapsed", key="text_data")
-            if st.button("Processar Texto Colado", use_container_width=True, disabled=not text_data):
-                with st.spinner("Processando texto..."):
-                    result = process_raw_text(text_data)
-                    handle_processed_result(result)
+            with st.form("text_form", border=False):
+                text_data = st.text_area("Cole os dados aqui", height=200, label_visibility="collapsed", key="text_data")
+                submitted = st.form_submit_button("Processar Texto Colado", use_container_width=True)
+            if submitted:
+                if not text_data:
+                    st.warning("Cole os dados antes de processar.")
+                else:
+                    with st.spinner("Processando texto..."):
+                        result = run_cached_processing('text', text_data)
+                        handle_processed_result(result)
 
     else:
         st.header("2. Revise e Edite sua Rota")
+        flush_points_buffer()
         
         draw_ai_tools_section()
         
-        st.markdown("Arraste as linhas para reordenar, clique duas vezes para editar e use as caixas de seleção para apagar pontos.")
-        
-        df_for_grid = st.session_state.processed_data.copy()
-        gb = GridOptionsBuilder.from_dataframe(df_for_grid)
-        gb.configure_default_column(editable=True, groupable=True)
-        gb.configure_grid_options(rowDragManaged=True)
-        gb.configure_selection(selection_mode='multiple', use_checkbox=True, header_checkbox=True)
-        
-        if not df_for_grid.empty:
-            gb.configure_column(df_for_grid.columns[0], rowDrag=True)
-        
-        if 'Google Maps' in df_for_grid.columns:
-            cell_renderer = JsCode("""
-                class LinkRenderer {
-                    init(params) {
-                        this.eGui = document.createElement('a');
-                        this.eGui.innerText = 'Abrir no Mapa';
-                        this.eGui.setAttribute('href', params.value);
-                        this.eGui.setAttribute('target', '_blank');
-                    }
-                    getGui() {
-                        return this.eGui;
-                    }
-                }
-            """)
-            gb.configure_column("Google Maps", cellRenderer=cell_renderer, editable=False)
-        
-        grid_options = gb.build()
-
-        ag_grid_response = AgGrid(
-            df_for_grid,
-            gridOptions=grid_options,
-            update_mode=GridUpdateMode.MODEL_CHANGED,
-            data_return_mode=DataReturnMode.AS_INPUT,
-            allow_unsafe_jscode=True,    
-            height=400,
-            fit_columns_on_grid_load=True,
-            key='editable_grid'
-        )
-        
-        st.session_state.processed_data = ag_grid_response['data']
-        
-        selected_rows = ag_grid_response['selected_rows']
-        if st.button("Apagar Pontos Selecionados", disabled=not selected_rows):
-            if selected_rows:
-                indices_to_drop = [row['_selectedRowNodeInfo']['nodeRowIndex'] for row in selected_rows]
-                df_to_keep = st.session_state.processed_data.drop(indices_to_drop).reset_index(drop=True)
-                st.session_state.processed_data = add_maps_link_column(df_to_keep)
-                st.success(f"{len(selected_rows)} ponto(s) apagado(s).")
-                st.rerun()
-        
+        draw_route_editor()
         draw_add_point_section()
-        draw_optimization_controls()
-        draw_results_section()
+        draw_route_outputs()
 
 
 # --- INÍCIO DA EXECUÇÃO DO APP ---
@@ -1,68 +1,200 @@
 # lembrete_commit_v2.py
 # Um script para lembrar ou automatizar commits e pushes em um repositório Git.
 # VERSÃO 2.0: Adicionado modo automático para commits e pushes periódicos.
+# VERSÃO 2.1: Lista de arquivos alterados lida do formato NUL (-z) do git status.
+# VERSÃO 2.2: Branch, remote e upstream consultados uma vez por sessão para o push.
+# VERSÃO 2.3: Status e commit feitos no próprio processo via pygit2, quando instalado.
+# VERSÃO 2.4: Pop-up nativo do Windows (MessageBoxW) no lugar da janela Tkinter.
+# VERSÃO 2.5: Arquivo de log aberto uma vez por sessão, com buffer de linha.
+# VERSÃO 2.6: Espera entre ciclos com threading.Event; Ctrl+C encerra na hora.
+# VERSÃO 2.7: Espera em fatias de 1 s, para o Ctrl+C ser atendido também no Windows.
+# VERSÃO 2.8: Commits assinados (commit.gpgsign) ou com hooks voltam ao git de linha de comando.
 
 import time
 import os
+import atexit
+import signal
+import threading
+import functools
 import subprocess
+import ctypes
 import tkinter as tk
 from tkinter import ttk
 from datetime import datetime
 
+try:
+    # Opcional: com o pygit2 (libgit2) status e commit não abrem um processo `git`
+    # a cada ciclo. Sem ele, tudo continua via subprocess.
+    import pygit2
+except ImportError:
+    pygit2 = None
+
 # ==============================================================================
 # SEÇÃO 1: UTILITÁRIOS E FUNÇÕES GIT
 # ==============================================================================
 
+@functools.lru_cache(maxsize=1)
+def open_repo():
+    """Abre o repositório do diretório atual com o pygit2, uma vez por sessão. Retorna None sem pygit2."""
+    if pygit2 is None:
+        return None
+    try:
+        path = pygit2.discover_repository(os.getcwd())
+        return pygit2.Repository(path) if path else None
+    except pygit2.GitError as e:
+        print(f"Erro ao abrir o repositório com pygit2: {e}")
+        return None
+
 def is_git_repo():
     """Verifica se o diretório atual é um repositório Git."""
+    repo = open_repo()
+    if repo is not None:
+        return not repo.is_bare
     result = subprocess.run(["git", "rev-parse", "--is-inside-work-tree"], capture_output=True, text=True, creationflags=subprocess.CREATE_NO_WINDOW)
     return result.returncode == 0 and result.stdout.strip() == "true"
 
 def get_modified_files():
     """Retorna uma lista de arquivos modificados, adicionados ou renomeados."""
-    result = subprocess.run(["git", "status", "--porcelain"], capture_output=True, text=True, creationflags=subprocess.CREATE_NO_WINDOW)
+    repo = open_repo()
+    if repo is not None:
+        # O pygit2 não detecta renomeações: aparecem o arquivo apagado e o novo.
+        return [
+            path for path, flags in repo.status().items()
+            if flags != pygit2.GIT_STATUS_CURRENT and not flags & pygit2.GIT_STATUS_IGNORED
+        ]
+    result = subprocess.run(["git", "status", "--porcelain=v1", "-z"], capture_output=True, creationflags=subprocess.CREATE_NO_WINDOW)
     files = []
-    for line in result.stdout.splitlines():
-        if not line.strip():
+    # No formato -z cada entrada termina em NUL e os nomes vêm sem aspas, então
+    # espaços e "->" no nome do arquivo não atrapalham a leitura.
+    entries = iter(result.stdout.split(b"\0"))
+    for entry in entries:
+        if not entry:
             continue
-        # Extrai o nome do arquivo, lidando com renomeações
-        name = line[3:]
-        if "->" in name:
-            name = name.split("->", 1)[1].strip()
-        files.append(name)
+        files.append(os.fsdecode(entry[3:]))
+        # Em renomeações e cópias o nome de origem vem na entrada seguinte.
+        if entry[:1] in (b"R", b"C"):
+            next(entries, None)
     return files
 
+# Hooks executados pelo `git commit`; o pygit2 não executa nenhum deles.
+_COMMIT_HOOKS = ("pre-commit", "prepare-commit-msg", "commit-msg", "post-commit")
+
+def _needs_git_cli(repo):
+    """
+    Indica se o commit precisa do git de linha de comando: o pygit2 não assina
+    commits (commit.gpgsign) nem executa hooks, e criaria commits sem avisar.
+    """
+    try:
+        if repo.config.get_bool("commit.gpgsign"):
+            return True
+    except KeyError:
+        pass
+    try:
+        hooks_dir = os.path.join(repo.workdir or repo.path, os.path.expanduser(repo.config["core.hooksPath"]))
+    except KeyError:
+        hooks_dir = os.path.join(repo.path, "hooks")
+    return any(os.path.isfile(os.path.join(hooks_dir, hook)) for hook in _COMMIT_HOOKS)
+
+def _pygit2_add_commit(repo, message):
+    """Equivalente a `git add -A` + `git commit` no próprio processo (sem executar hooks)."""
+    index = repo.index
+    index.add_all()
+    index.update_all()
+    index.write()
+    tree = index.write_tree()
+    parents = [] if repo.head_is_unborn else [repo.head.target]
+    if parents and repo[parents[0]].tree_id == tree:
+        return False  # Nada para commitar
+    signature = repo.default_signature
+    repo.create_commit("HEAD", signature, signature, message, tree, parents)
+    return True
+
 def git_add_commit(message):
     """Adiciona todos os arquivos e faz um commit."""
+    repo = open_repo()
+    if repo is not None:
+        try:
+            if not _needs_git_cli(repo):
+                return _pygit2_add_commit(repo, message)
+        except (pygit2.GitError, KeyError) as e:
+            # Ex.: user.name/user.email ausentes; o git de linha de comando decide.
+            print(f"Erro no commit via pygit2, usando o git: {e}")
     subprocess.run(["git", "add", "-A"], creationflags=subprocess.CREATE_NO_WINDOW)
     commit_result = subprocess.run(["git", "commit", "-m", message], capture_output=True, text=True, creationflags=subprocess.CREATE_NO_WINDOW)
     # Retorna True se o commit foi bem-sucedido (ou seja, havia algo para commitar)
     return "nothing to commit" not in commit_result.stdout and commit_result.returncode == 0
 
-def git_push():
-    """Faz push para o 'origin'."""
-    branch_result = subprocess.run(["git", "rev-parse", "--abbrev-ref", "HEAD"], capture_output=True, text=True, creationflags=subprocess.CREATE_NO_WINDOW)
-    branch = branch_result.stdout.strip() if branch_result.returncode == 0 else "main"
+# Branch, remote e upstream mudam raramente durante uma sessão; são consultados
+# uma vez em `main()` e reaproveitados a cada push.
+_git_session = {"branch": "main", "has_origin": False, "has_upstream": False}
 
-    remote_result = subprocess.run(["git", "remote"], capture_output=True, text=True, creationflags=subprocess.CREATE_NO_WINDOW)
-    if "origin" not in remote_result.stdout.splitlines():
-        return False, "remote 'origin' não encontrado"
+def probe_git_session():
+    """Consulta o branch atual, o remote 'origin' e o upstream e guarda o resultado."""
+    branch_result = subprocess.run(["git", "symbolic-ref", "--short", "HEAD"], capture_output=True, text=True, creationflags=subprocess.CREATE_NO_WINDOW)
+    if branch_result.returncode == 0:
+        _git_session["branch"] = branch_result.stdout.strip()
+
+    origin_result = subprocess.run(["git", "remote", "get-url", "origin"], capture_output=True, text=True, creationflags=subprocess.CREATE_NO_WINDOW)
+    _git_session["has_origin"] = origin_result.returncode == 0
 
     # Verifica se o branch remoto (upstream) está configurado
     upstream_result = subprocess.run(["git", "rev-parse", "--abbrev-ref", "--symbolic-full-name", "@{u}"], capture_output=True, text=True, creationflags=subprocess.CREATE_NO_WINDOW)
-    if upstream_result.returncode == 0:
+    _git_session["has_upstream"] = upstream_result.returncode == 0
+
+def git_push():
+    """Faz push para o 'origin'."""
+    if not _git_session["has_origin"]:
+        # O remote pode ter sido adicionado depois do início da sessão.
+        probe_git_session()
+        if not _git_session["has_origin"]:
+            return False, "remote 'origin' não encontrado"
+
+    if _git_session["has_upstream"]:
         push_command = ["git", "push"]
     else:
-        push_command = ["git", "push", "-u", "origin", branch]
+        push_command = ["git", "push", "-u", "origin", _git_session["branch"]]
 
     push_result = subprocess.run(push_command, capture_output=True, text=True, creationflags=subprocess.CREATE_NO_WINDOW)
+    if push_result.returncode == 0:
+        _git_session["has_upstream"] = True
     return push_result.returncode == 0, push_result.stderr.strip()
 
-def write_log(log_path, lines):
+# Sinaliza o fim da sessão; a espera entre ciclos o percebe em até 1 segundo.
+_stop = threading.Event()
+
+def wait_interval(seconds: float) -> bool:
+    """
+    Aguarda `seconds` segundos ou até `_stop` ser sinalizado; retorna True se
+    a sessão deve terminar. Espera em fatias curtas porque, no Windows, um
+    Event.wait longo não é interrompido pelo Ctrl+C e o handler só rodaria
+    ao fim do intervalo.
+    """
+    deadline = time.monotonic() + seconds
+    while not _stop.is_set():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        _stop.wait(min(1.0, remaining))
+    return True
+
+# Arquivo de log da sessão, aberto uma vez em `main()` e fechado na saída.
+_log_file = None
+
+def open_log(log_path):
+    """Abre o arquivo de log em modo append com buffer de linha."""
+    global _log_file
+    try:
+        _log_file = open(log_path, "a", encoding="utf-8", buffering=1)
+        atexit.register(_log_file.close)
+    except OSError as e:
+        print(f"Erro ao abrir o log: {e}")
+
+def write_log(lines):
     """Escreve uma entrada no arquivo de log."""
+    if _log_file is None:
+        return
     try:
-        with open(log_path, "a", encoding="utf-8") as f:
-            f.write("\n".join(lines) + "\n" + ("-" * 60) + "\n")
+        _log_file.write("\n".join(lines) + "\n" + ("-" * 60) + "\n")
     except Exception as e:
         print(f"Erro ao escrever no log: {e}")
 
@@ -77,8 +209,48 @@ def play_sound(root):
 # SEÇÃO 2: JANELA DE POP-UP (MODO INTERATIVO)
 # ==============================================================================
 
+# Constantes do MessageBoxW (user32).
+MB_YESNO = 0x4
+MB_YESNOCANCEL = 0x3
+MB_ICONINFORMATION = 0x40
+MB_ICONQUESTION = 0x20
+MB_TOPMOST = 0x40000
+IDYES, IDNO, IDCANCEL = 6, 7, 2
+MAX_FILES_TEXT = 1024
+
+def native_commit_prompt(interval_min, session_str, files):
+    """
+    Pop-up do modo interativo com o MessageBoxW do Windows: sem subir um
+    interpretador Tk a cada ciclo. Sim = salvar, Não = ignorar, Cancelar =
+    encerrar; o push é perguntado numa segunda caixa só quando há commit.
+    """
+    result = {"commit": False, "push": False, "action": "ignorar"}
+    files_text = "\n".join(files) if files else "Nenhuma alteração detectada."
+    if len(files_text) > MAX_FILES_TEXT:
+        files_text = files_text[:MAX_FILES_TEXT].rsplit("\n", 1)[0] + "\n..."
+
+    message = (
+        f"Passaram-se {interval_min} minutos.\nTempo de sessão: {session_str}\n\n"
+        f"Arquivos alterados ({len(files)}):\n{files_text}\n\n"
+        "Salvar localmente (commit)?\n\nSim = Salvar   Não = Ignorar   Cancelar = Encerrar"
+    )
+    user32 = ctypes.windll.user32
+    answer = user32.MessageBoxW(0, message, "Lembrete de Commit", MB_YESNOCANCEL | MB_ICONINFORMATION | MB_TOPMOST)
+    if answer == IDCANCEL:
+        result["action"] = "encerrar"
+    elif answer == IDYES:
+        result["action"] = "salvar"
+        result["commit"] = True
+        push_answer = user32.MessageBoxW(0, "Enviar para o repositório remoto (push)?", "Lembrete de Commit", MB_YESNO | MB_ICONQUESTION | MB_TOPMOST)
+        result["push"] = push_answer == IDYES
+    return result
+
 def popup_commit_window(interval_min, session_str, files):
     """Cria e exibe a janela de pop-up para o modo interativo."""
+    if os.name == "nt":
+        return native_commit_prompt(interval_min, session_str, files)
+
+    # Fora do Windows continua a janela Tkinter.
     result = {"commit": False, "push": False, "action": "ignorar"}
 
     root = tk.Tk()
@@ -152,7 +324,7 @@ def popup_commit_window(interval_min, session_str, files):
 # SEÇÃO 3: LÓGICA DOS MODOS DE EXECUÇÃO
 # ==============================================================================
 
-def run_interactive_cycle(log_path, session_start, interval_min):
+def run_interactive_cycle(session_start, interval_min):
     """Executa um ciclo do modo interativo (com pop-up)."""
     session_str = f"{int((time.time() - session_start) / 60)} minutos"
     files = get_modified_files()
@@ -165,14 +337,15 @@ def run_interactive_cycle(log_path, session_start, interval_min):
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
     if response["action"] == "encerrar":
+        _stop.set()
         log_lines = [f"[{timestamp}] 🛑 Sessão encerrada pelo usuário", f"  Duração: {session_str}"]
-        write_log(log_path, log_lines)
+        write_log(log_lines)
         print("🛑 Sessão encerrada pelo usuário.")
         return False # Encerra o loop
 
     elif response["action"] == "ignorar":
         log_lines = [f"[{timestamp}] ⏭️ Commit ignorado", f"  Duração: {session_str}", f"  Arquivos: {(', '.join(files) if files else '—')}"]
-        write_log(log_path, log_lines)
+        write_log(log_lines)
         print("⏭️ Commit ignorado desta vez.")
         return True
 
@@ -204,10 +377,10 @@ def run_interactive_cycle(log_path, session_start, interval_min):
         f"  Commit: {commit_status}",
         f"  Push: {push_status}"
     ]
-    write_log(log_path, log_lines)
+    write_log(log_lines)
     return True
 
-def run_automatic_cycle(log_path, session_start, auto_push):
+def run_automatic_cycle(session_start, auto_push):
     """Executa um ciclo do modo automático (sem pop-up)."""
     files = get_modified_files()
     if not files:
@@ -240,7 +413,7 @@ def run_automatic_cycle(log_path, session_start, auto_push):
         f"  Arquivos: {(', '.join(files) if files else '—')}",
         f"  Push: {push_status}"
     ]
-    write_log(log_path, log_lines)
+    write_log(log_lines)
 
 # ==============================================================================
 # SEÇÃO 4: FUNÇÃO PRINCIPAL
@@ -253,6 +426,7 @@ def main():
         print("❌ ERRO: Esta pasta não é um repositório Git. Encerrando.")
         time.sleep(5)
         return
+    probe_git_session()
 
     # --- Configuração Inicial ---
     mode = input("▶️ Modo de execução: [A]utomático ou [I]nterativo (padrão=I): ").strip().upper()
@@ -274,31 +448,29 @@ def main():
         interval_min = 20
     
     session_start = time.time()
-    log_path = os.path.join(os.getcwd(), "commits_log.txt")
+    open_log(os.path.join(os.getcwd(), "commits_log.txt"))
     
     print(f"\n✅ Configuração concluída. Verificando a cada {interval_min} minutos.")
     print("Pressione Ctrl+C para encerrar a qualquer momento.")
     print("-" * 35)
 
+    # Ctrl+C só sinaliza o fim; o ciclo em andamento termina e a espera acorda na hora.
+    signal.signal(signal.SIGINT, lambda signum, frame: _stop.set())
+
     # --- Loop Principal ---
-    while True:
-        try:
-            # Aguarda o intervalo definido
-            time.sleep(interval_min * 60)
-            
-            if mode == 'A':
-                run_automatic_cycle(log_path, session_start, auto_push)
-            else: # Modo Interativo
-                if not run_interactive_cycle(log_path, session_start, interval_min):
-                    break # Encerra se a função retornar False
-
-        except KeyboardInterrupt:
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            session_str = f"{int((time.time() - session_start) / 60)} minutos"
-            log_lines = [f"[{timestamp}] 🛑 Sessão encerrada (Ctrl+C)", f"  Duração: {session_str}"]
-            write_log(log_path, log_lines)
-            print("\n🛑 Encerrado pelo usuário (Ctrl+C).")
-            break
+    # Aguarda o intervalo definido; wait_interval() retorna True após o Ctrl+C.
+    while not wait_interval(interval_min * 60):
+        if mode == 'A':
+            run_automatic_cycle(session_start, auto_push)
+        else: # Modo Interativo
+            if not run_interactive_cycle(session_start, interval_min):
+                break # Encerra se a função retornar False
+    else:
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        session_str = f"{int((time.time() - session_start) / 60)} minutos"
+        log_lines = [f"[{timestamp}] 🛑 Sessão encerrada (Ctrl+C)", f"  Duração: {session_str}"]
+        write_log(log_lines)
+        print("\n🛑 Encerrado pelo usuário (Ctrl+C).")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,80 @@
+# src/cache.py
+# Cache persistente em disco para resultados de chamadas caras (APIs externas).
+# VERSÃO 3.1.1: Entradas expiradas apagadas na abertura; diário WAL para escritas sem fsync a cada commit.
+
+import os
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+# Importa as configurações centralizadas
+from src.config import CACHE_DIR
+
+class DiskCache:
+    """
+    Cache chave/valor guardado num arquivo SQLite, compartilhado entre sessões
+    e reinícios do Streamlit. Os valores são serializados em JSON e podem ter
+    um tempo de expiração (em segundos).
+
+    Falhas de leitura ou escrita nunca interrompem a aplicação: o cache apenas
+    se comporta como vazio.
+
+    As entradas expiradas são apagadas sempre que o cache é aberto, para o
+    arquivo não crescer indefinidamente. O diário WAL com synchronous=NORMAL
+    evita um fsync por escrita, que enfileiraria as threads de fundo no lock.
+    """
+
+    def __init__(self, name: str, directory: str = CACHE_DIR):
+        self.path = os.path.join(directory, f"{name}.sqlite3")
+        self._lock = threading.Lock()
+        self._conn = None
+        try:
+            os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+            self._conn.execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),))
+            self._conn.commit()
+        except (OSError, sqlite3.Error) as e:
+            print(f"ERRO: Não foi possível abrir o cache em disco '{self.path}': {e}")
+            self._conn = None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Retorna o valor guardado para a chave, ou `default` se não existir ou tiver expirado."""
+        if self._conn is None:
+            return default
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"ERRO ao ler o cache em disco: {e}")
+            return default
+
+        if row is None:
+            return default
+        value, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            return default
+        return json.loads(value)
+
+    def set(self, key: str, value: Any, expire: Optional[float] = None):
+        """Guarda um valor serializável em JSON, opcionalmente com expiração em segundos."""
+        if self._conn is None:
+            return
+        expires_at = time.time() + expire if expire else None
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), expires_at)
+                )
+                self._conn.commit()
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            print(f"ERRO ao escrever no cache em disco: {e}")
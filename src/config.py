@@ -1,9 +1,33 @@
 # src/config.py
 # Módulo para centralizar as configurações da aplicação.
-# VERSÃO 3.1.0: Criação do arquivo de configuração.
+# VERSÃO 3.1.11: Validade curta para endereços não encontrados na geocodificação.
+
+import os
 
 # --- Configurações da API do OpenRouteService ---
 ORS_BASE_URL = "https://api.openrouteservice.org"
+ORS_MAX_WORKERS = 10                    # Requisições simultâneas em segundo plano
+ORS_GEOCODE_RPM = 40                    # Geocodificações por minuto (cota do plano gratuito)
+AUTOCOMPLETE_PREFIX_MAX_RESULTS = 5     # Abaixo disso, o texto seguinte é filtrado localmente
+AUTOCOMPLETE_PREFIX_ENTRIES = 256       # Consultas recentes guardadas em memória para isso
+
+# --- Links encurtados do Google Maps (maps.app.goo.gl) ---
+SHORT_LINK_MAX_WORKERS = 16             # Resoluções simultâneas ao importar uma planilha
+
+# --- Otimizador offline (OR-Tools) ---
+OPTIMIZER_MAX_SECONDS = 30              # Teto do tempo de busca, para rotas grandes
+OPTIMIZER_SMALL_ROUTE = 20              # Abaixo disso, a busca para após poucas soluções
+OPTIMIZER_SMALL_SOLUTION_LIMIT = 50
 
 # --- Configurações da API do Google Gemini ---
 GEMINI_MODEL_NAME = "gemini-1.5-flash-latest"
+GEMINI_MAX_WORKERS = 4                  # Lotes enviados ao mesmo tempo
+GEMINI_RPM = 15                         # Requisições por minuto (cota do plano gratuito)
+
+# --- Configurações do cache em disco ---
+CACHE_DIR = os.environ.get("OTIMIZADOR_CACHE_DIR", ".cache")
+GEOCODE_CACHE_TTL = 30 * 24 * 3600      # 30 dias
+GEOCODE_MISS_CACHE_TTL = 3600           # 1 hora para endereços não encontrados
+AUTOCOMPLETE_CACHE_TTL = 3600           # 1 hora
+ROUTE_CACHE_TTL = 7 * 24 * 3600         # 7 dias (a malha viária muda pouco)
+GEMINI_CACHE_TTL = 7 * 24 * 3600        # 7 dias
@@ -1,99 +1,208 @@
 # src/data_handler.py
 # Responsável por carregar, analisar, limpar e processar os dados de entrada.
-# VERSÃO 3.0.15: Implementada a lógica de deteção de divergências.
+# VERSÃO 3.0.40: Duplicatas comparadas por coordenadas e Nome normalizado, para manter paradas distintas no mesmo endereço.
 
+import numpy as np
 import pandas as pd
-import tempfile
 import os
 import re
 import requests
+from requests.adapters import HTTPAdapter
+from http.cookiejar import DefaultCookiePolicy
 import io
-from lxml import etree
-import gpxpy
-from typing import Dict, Any, Optional, Tuple, List
+import csv
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import xml.etree.ElementTree as ET
+from typing import Dict, Any, Optional, Tuple, List, IO, Iterator
+try:
+    import pyarrow  # noqa: F401 - engine opcional do pd.read_csv
+except ImportError:
+    pyarrow = None
+try:
+    import python_calamine  # noqa: F401 - engine opcional do pd.read_excel
+    EXCEL_ENGINE: Optional[str] = 'calamine'
+except ImportError:
+    EXCEL_ENGINE = None  # openpyxl, o padrão do pandas
 
 # Importa a função de cálculo de distância do nosso módulo de utilitários
-from src.utils import haversine_distance
+from src.utils import haversine_distances
+from src.config import SHORT_LINK_MAX_WORKERS
+
+# Sessão HTTP compartilhada pelos downloads do Google: reaproveita as conexões TLS
+# entre chamadas. Não guarda cookies, pois é usada por todos os usuários do app.
+_SESSION = requests.Session()
+_SESSION.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=SHORT_LINK_MAX_WORKERS))
+_DRIVE_HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
+
+# --- EXPRESSÕES REGULARES PRÉ-COMPILADAS ---
+_CLEAN_RE = re.compile(r"[°'\"()NnSsOoWwEe]")
+_COORD_CLEAN_RE = re.compile(r"[°'\"NnSsOoWwEe\s]")
+# Número decimal; público porque a interface o usa para detectar coordenadas digitadas.
+DECIMAL_RE = re.compile(r"-?\d+\.\d+")
+_AT_RE = re.compile(r"@(-?\d+\.\d+),(-?\d+\.\d+)")
+_DIR_RE = re.compile(r"!2d(-?\d+\.\d+)!3d(-?\d+\.\d+)|!3d(-?\d+\.\d+)!4d(-?\d+\.\d+)")
+_Q_RE = re.compile(r"\?q=(-?\d+\.\d+),(-?\d+\.\d+)")
+# Os dois primeiros números decimais de um texto (mesmo par que DECIMAL_RE.findall encontra).
+# O (?!\d) impede que o primeiro número seja encurtado para achar um segundo: em
+# "1.23.45" o findall só vê "1.23", e sem ele o par seria ("1.2", "3.45").
+_PAIR_RE = re.compile(r"(-?\d+\.\d+)(?!\d).*?(-?\d+\.\d+)", re.DOTALL)
+# Identificadores nos links do Google My Maps e do Google Drive.
+_MID_RE = re.compile(r"mid=([a-zA-Z0-9_-]+)")
+_DRIVE_D_RE = re.compile(r"/d/([a-zA-Z0-9_-]+)")
+_DRIVE_ID_RE = re.compile(r"id=([a-zA-Z0-9_-]+)")
 
 # --- SEÇÃO 1: PARSERS DE ARQUIVO E EXTRAÇÃO DE DADOS BRUTOS ---
 
-def _parse_gpx_file(file_path: str) -> pd.DataFrame:
-    """Analisa um arquivo GPX para extrair os waypoints (pontos)."""
-    points = []
+def _points_frame(names: List[str], lats: List[float], lons: List[float]) -> pd.DataFrame:
+    """Monta o DataFrame de pontos a partir de listas por coluna."""
+    return pd.DataFrame({
+        "Nome": names,
+        "Latitude": np.asarray(lats, dtype=np.float64),
+        "Longitude": np.asarray(lons, dtype=np.float64),
+    })
+
+def _iter_records(source: IO[bytes], local_name: str) -> Iterator[Tuple[str, ET.Element]]:
+    """
+    Percorre um XML em streaming (iterparse) e entrega, já completos, os
+    elementos cujo nome local é `local_name`, junto do prefixo de namespace
+    deles (ex.: '{http://www.opengis.net/kml/2.2}'). Depois de usado, cada
+    elemento é removido do pai, então a memória não cresce com o arquivo.
+    """
+    parents: List[ET.Element] = []
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            parents.append(elem)
+            continue
+        parents.pop()
+        namespace, _, tag = elem.tag.rpartition('}')
+        if tag != local_name:
+            continue
+        yield (namespace + '}' if namespace else ''), elem
+        if parents:
+            parents[-1].remove(elem)
+
+def _parse_gpx_bytes(content: bytes) -> pd.DataFrame:
+    """
+    Extrai os waypoints (<wpt>) de um GPX em streaming (iterparse), aceitando
+    os namespaces do GPX 1.0 e 1.1.
+    """
+    names: List[str] = []
+    lats: List[float] = []
+    lons: List[float] = []
     try:
-        with open(file_path, 'r', encoding='utf-8') as gpx_file:
-            gpx = gpxpy.parse(gpx_file)
-        for waypoint in gpx.waypoints:
-            points.append({
-                "Nome": waypoint.name or "Waypoint GPX", 
-                "Latitude": waypoint.latitude, 
-                "Longitude": waypoint.longitude
-            })
-        return pd.DataFrame(points)
+        for ns, elem in _iter_records(io.BytesIO(content), 'wpt'):
+            names.append(elem.findtext(ns + 'name') or "Waypoint GPX")
+            lats.append(float(elem.attrib['lat']))
+            lons.append(float(elem.attrib['lon']))
+        return _points_frame(names, lats, lons)
     except Exception as e:
         print(f"ERRO ao analisar o arquivo GPX: {e}")
         return pd.DataFrame()
 
-def _parse_kml_tree(tree: etree._ElementTree) -> pd.DataFrame:
-    """Extrai pontos de uma estrutura de árvore KML."""
-    points = []
-    ns = {'kml': 'http://www.opengis.net/kml/2.2'}
-    for placemark in tree.xpath('.//kml:Placemark', namespaces=ns):
-        name = placemark.findtext('kml:name', default="Ponto KML", namespaces=ns).strip()
-        coords_text = placemark.findtext('.//kml:coordinates', default="", namespaces=ns).strip()
+def _parse_kml_bytes(content: bytes) -> pd.DataFrame:
+    """Extrai pontos de um KML já carregado em memória."""
+    return _parse_kml_stream(io.BytesIO(content))
+
+def _parse_kml_stream(source: IO[bytes]) -> pd.DataFrame:
+    """
+    Extrai pontos de um KML lendo os Placemarks em streaming, com a memória
+    limitada ao Placemark atual.
+    """
+    names: List[str] = []
+    lats: List[float] = []
+    lons: List[float] = []
+    for ns, elem in _iter_records(source, 'Placemark'):
+        name = (elem.findtext(ns + 'name') or "Ponto KML").strip()
+        coords_text = (elem.findtext('.//' + ns + 'coordinates') or "").strip()
         if coords_text:
             coords = coords_text.split(',')
             if len(coords) >= 2:
-                points.append({
-                    "Nome": name, 
-                    "Latitude": float(coords[1]), 
-                    "Longitude": float(coords[0])
-                })
-    return pd.DataFrame(points)
+                lats.append(float(coords[1]))
+                lons.append(float(coords[0]))
+                names.append(name)
+    return _points_frame(names, lats, lons)
+
+CSV_SNIFF_BYTES = 64 * 1024
+
+def _sniff_csv_separator(file_content: bytes) -> str:
+    """
+    Detecta o separador pela primeira linha do CSV, como o `sep=None` do pandas
+    faz, para que a leitura completa use o engine C (o `sep=None` exige o engine Python).
+    """
+    first_line = file_content[:CSV_SNIFF_BYTES].split(b'\n', 1)[0].decode('utf-8', errors='ignore')
+    try:
+        return csv.Sniffer().sniff(first_line, delimiters=",;\t|").delimiter
+    except csv.Error:
+        return ','
+
+PYARROW_CSV_MIN_BYTES = 1024 * 1024
+
+def _read_csv(file_content: bytes, sep: str) -> pd.DataFrame:
+    """
+    Lê um CSV já com o separador detectado. Arquivos grandes em UTF-8 usam o
+    engine pyarrow (multithread); os demais, ou se o pyarrow falhar, usam o engine C.
+    """
+    if pyarrow is not None and len(file_content) >= PYARROW_CSV_MIN_BYTES:
+        try:
+            # O pyarrow não acusa bytes inválidos; valida o UTF-8 antes para cair no latin-1.
+            file_content.decode('utf-8')
+            return pd.read_csv(io.BytesIO(file_content), on_bad_lines='skip', sep=sep, encoding='utf-8', engine='pyarrow')
+        except Exception:
+            pass
+    try:
+        return pd.read_csv(io.BytesIO(file_content), on_bad_lines='skip', sep=sep, encoding='utf-8')
+    except UnicodeDecodeError:
+        return pd.read_csv(io.BytesIO(file_content), on_bad_lines='skip', sep=sep, encoding='latin-1')
 
 def _parse_csv_or_excel(file_content: bytes, is_excel: bool) -> pd.DataFrame:
     """Lê o conteúdo de um arquivo CSV ou XLSX e o retorna como um DataFrame."""
     try:
         if is_excel:
-            return pd.read_excel(io.BytesIO(file_content))
+            return pd.read_excel(io.BytesIO(file_content), engine=EXCEL_ENGINE)
         else:
-            try:
-                text_content = file_content.decode('utf-8')
-            except UnicodeDecodeError:
-                text_content = file_content.decode('latin-1')
-            return pd.read_csv(io.StringIO(text_content), on_bad_lines='skip', sep=None, engine='python')
+            return _read_csv(file_content, _sniff_csv_separator(file_content))
     except Exception as e:
         print(f"ERRO ao ler o conteúdo da planilha: {e}")
         return pd.DataFrame()
 
 # --- SEÇÃO 2: LÓGICA DE LIMPEZA E VALIDAÇÃO ---
 
-def _auto_detect_and_standardize_columns(df: pd.DataFrame) -> pd.DataFrame:
-    """Tenta detetar e padronizar as colunas de Latitude, Longitude, Nome e Link."""
-    df_copy = df.copy()
-    rename_map = {}
-    keywords = {
+# Palavra-chave (em minúsculas) -> (coluna padrão, prioridade). Quando várias
+# colunas indicam o mesmo padrão, vence a de menor prioridade.
+_COLUMN_KEYWORDS: Dict[str, Tuple[str, int]] = {
+    kw: (standard_name, rank)
+    for standard_name, kws in {
         'Latitude': ['latitude', 'lat'],
         'Longitude': ['longitude', 'lon', 'lng'],
         'Nome': ['nome', 'name', 'título', 'ref', 'ponto', 'local', 'referencia'],
         'Link': ['link', 'url', 'gmaps', 'maps']
-    }
-    df_cols_lower = {str(c).lower(): c for c in df_copy.columns}
-    
-    for standard_name, kws in keywords.items():
-        if standard_name not in df_copy.columns:
-            for kw in kws:
-                if kw in df_cols_lower:
-                    original_col_name = df_cols_lower[kw]
-                    rename_map[original_col_name] = standard_name
-                    break
-    if rename_map:
-        df_copy.rename(columns=rename_map, inplace=True)
+    }.items()
+    for rank, kw in enumerate(kws)
+}
+
+def _auto_detect_and_standardize_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Tenta detetar e padronizar as colunas de Latitude, Longitude, Nome e Link.
+    Retorna um DataFrame novo, sem alterar o original; como só os nomes mudam,
+    o `rename` (sem inplace) compartilha os dados das colunas.
+    """
+    best: Dict[str, Tuple[int, Any]] = {}
+    for col in df.columns:
+        match = _COLUMN_KEYWORDS.get(str(col).lower())
+        if match is None or match[0] in df.columns:
+            continue
+        standard_name, rank = match
+        # Com nomes repetidos (sem diferenciar maiúsculas), vale a última coluna.
+        if standard_name not in best or rank <= best[standard_name][0]:
+            best[standard_name] = (rank, col)
+    df_std = df.rename(columns={col: standard_name for standard_name, (_, col) in best.items()})
     
-    if 'Latitude' not in df_copy.columns or 'Longitude' not in df_copy.columns:
+    if 'Latitude' not in df_std.columns or 'Longitude' not in df_std.columns:
         coord_cols = {}
-        for col in df_copy.columns:
-            numeric_col = pd.to_numeric(df_copy[col], errors='coerce').dropna()
+        for col in df_std.columns:
+            numeric_col = pd.to_numeric(df_std[col], errors='coerce').dropna()
             if not numeric_col.empty:
                 is_lat = numeric_col.between(-90, 90).all()
                 is_lon = numeric_col.between(-180, 180).all()
@@ -101,9 +210,9 @@ def _auto_detect_and_standardize_columns(df: pd.DataFrame) -> pd.DataFrame:
                 elif is_lon and not is_lat: coord_cols[col] = 'Longitude'
 
         if 'Latitude' in coord_cols.values() and 'Longitude' in coord_cols.values():
-            df_copy.rename(columns={v: k for k, v in coord_cols.items()}, inplace=True)
+            df_std = df_std.rename(columns={v: k for k, v in coord_cols.items()})
 
-    return df_copy
+    return df_std
 
 def _validate_coordinates(latitude: float, longitude: float) -> bool:
     """Verifica se uma coordenada está dentro dos limites geográficos válidos."""
@@ -112,6 +221,10 @@ def _validate_coordinates(latitude: float, longitude: float) -> bool:
     except (ValueError, TypeError):
         return False
 
+def _valid_coordinates_mask(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """Mesma regra de `_validate_coordinates`, aplicada a vetores (NaN é inválido)."""
+    return (lat >= -90) & (lat <= 90) & (lon >= -180) & (lon <= 180)
+
 def clean_data(df: pd.DataFrame) -> pd.DataFrame:
     """Limpa e valida as colunas de coordenadas de um DataFrame."""
     if 'Latitude' not in df.columns or 'Longitude' not in df.columns:
@@ -119,24 +232,63 @@ def clean_data(df: pd.DataFrame) -> pd.DataFrame:
     
     df_clean = df.copy()
 
-    def clean_coord_string(coord):
-        if isinstance(coord, str):
-            return re.sub(r"[°'\"NnSsOoWwEe\s]", "", coord).replace(',', '.')
-        return coord
-
-    df_clean['Latitude'] = df_clean['Latitude'].apply(clean_coord_string)
-    df_clean['Longitude'] = df_clean['Longitude'].apply(clean_coord_string)
-
-    df_clean['Latitude'] = pd.to_numeric(df_clean['Latitude'], errors='coerce')
-    df_clean['Longitude'] = pd.to_numeric(df_clean['Longitude'], errors='coerce')
-    df_clean.dropna(subset=['Latitude', 'Longitude'], inplace=True)
-    
-    valid_coords = df_clean.apply(
-        lambda row: _validate_coordinates(row['Latitude'], row['Longitude']), 
-        axis=1
-    )
+    def clean_coord_column(column: pd.Series) -> pd.Series:
+        # Colunas já numéricas não precisam de limpeza de texto; colunas object
+        # sem nenhum texto (floats, ints ou Decimal vindos do Excel) só são convertidas.
+        if pd.api.types.is_numeric_dtype(column):
+            return column
+        if pd.api.types.infer_dtype(column, skipna=True) not in ('string', 'mixed', 'mixed-integer'):
+            return pd.to_numeric(column, errors='coerce')
+        # O acessor .str devolve NaN para valores que não são texto; esses ficam como estavam.
+        cleaned = column.str.replace(_COORD_CLEAN_RE, "", regex=True).str.replace(',', '.', regex=False)
+        return pd.to_numeric(cleaned.where(cleaned.notna(), column), errors='coerce')
+
+    df_clean['Latitude'] = pd.to_numeric(clean_coord_column(df_clean['Latitude']), errors='coerce')
+    df_clean['Longitude'] = pd.to_numeric(clean_coord_column(df_clean['Longitude']), errors='coerce')
+
+    lat = df_clean['Latitude'].to_numpy(dtype=np.float64)
+    lon = df_clean['Longitude'].to_numpy(dtype=np.float64)
+    valid_coords = _valid_coordinates_mask(lat, lon)
     return df_clean[valid_coords].reset_index(drop=True)
 
+def drop_duplicate_points(df: pd.DataFrame, decimals: int = 5) -> Tuple[pd.DataFrame, int]:
+    """
+    Remove pontos com as mesmas coordenadas (arredondadas em `decimals` casas,
+    ~1 m com 5) e o mesmo Nome (sem diferenciar maiúsculas e espaços), mantendo
+    a primeira ocorrência e a ordem original. Paradas distintas no mesmo
+    endereço (unidades de um prédio, várias entregas num local) ficam na rota.
+    Lat/Lon quantizadas cabem em 32 bits cada e são combinadas num único int64,
+    então a comparação é feita por np.unique sobre um só vetor.
+    Retorna o DataFrame resultante e a quantidade de linhas removidas.
+    """
+    if df.empty or 'Latitude' not in df.columns or 'Longitude' not in df.columns:
+        return df, 0
+
+    scale = 10.0 ** decimals
+    lat = pd.to_numeric(df['Latitude'], errors='coerce').to_numpy(dtype=np.float64)
+    lon = pd.to_numeric(df['Longitude'], errors='coerce').to_numpy(dtype=np.float64)
+    finite = np.isfinite(lat) & np.isfinite(lon)
+    if not finite.any():
+        return df, 0
+
+    lat_q = np.round(lat[finite] * scale).astype(np.int64)
+    lon_q = np.round(lon[finite] * scale).astype(np.int64)
+    keys = (lat_q << 32) | (lon_q & 0xFFFFFFFF)
+    if 'Nome' in df.columns:
+        # Cada par (coordenada, nome normalizado) vira um único código int64.
+        names = df['Nome'][finite].astype('string').str.lower().str.split().str.join(' ')
+        name_codes, name_uniques = pd.factorize(names, use_na_sentinel=False)
+        coord_codes, _ = pd.factorize(keys)
+        keys = coord_codes.astype(np.int64) * len(name_uniques) + name_codes
+    _, first_idx = np.unique(keys, return_index=True)
+
+    keep = ~finite  # Linhas sem coordenadas válidas não são comparadas.
+    keep[np.flatnonzero(finite)[first_idx]] = True
+    removed = len(df) - int(keep.sum())
+    if not removed:
+        return df, 0
+    return df.iloc[keep].reset_index(drop=True), removed
+
 def add_maps_link_column(df: pd.DataFrame) -> pd.DataFrame:
     """Adiciona uma coluna com a URL do Google Maps ao DataFrame."""
     df_with_link = df.copy()
@@ -152,27 +304,35 @@ def add_maps_link_column(df: pd.DataFrame) -> pd.DataFrame:
     return df_with_link
 
 def _find_divergences(df: pd.DataFrame, threshold_meters: int = 50) -> List[Dict]:
-    """Compara coordenadas de colunas e de links, retornando as divergências."""
+    """
+    Compara coordenadas de colunas e de links, retornando as divergências.
+    As coordenadas dos links, a validação e as distâncias são calculadas para
+    a coluna inteira; só as linhas divergentes viram dicionários.
+    """
+    if df.empty:
+        return []
+
+    coords_link = extract_coords_from_series(df['Link'].astype(str))
+    lat = df['Latitude'].to_numpy(dtype=np.float64)
+    lon = df['Longitude'].to_numpy(dtype=np.float64)
+    link_lat = coords_link['Latitude'].to_numpy(dtype=np.float64)
+    link_lon = coords_link['Longitude'].to_numpy(dtype=np.float64)
+
+    comparable = ~np.isnan(link_lat) & _valid_coordinates_mask(lat, lon)
+    distances = np.zeros(len(df), dtype=np.int64)
+    distances[comparable] = haversine_distances(lat[comparable], lon[comparable], link_lat[comparable], link_lon[comparable])
+
+    names = df['Nome'].tolist() if 'Nome' in df.columns else None
     divergences = []
-    df_copy = df.copy()
-    
-    df_copy['coords_from_link'] = df_copy['Link'].astype(str).apply(extract_coords_from_text)
-    
-    for index, row in df_copy.iterrows():
-        coords_planilha = (row['Latitude'], row['Longitude'])
-        coords_link = row['coords_from_link']
-        
-        if coords_link and _validate_coordinates(coords_planilha[0], coords_planilha[1]):
-            distance = haversine_distance(coords_planilha[0], coords_planilha[1], coords_link[0], coords_link[1])
-            
-            if distance > threshold_meters:
-                divergences.append({
-                    "index": index,
-                    "nome": row.get('Nome', f'Ponto {index + 1}'),
-                    "coords_planilha": coords_planilha,
-                    "coords_link": coords_link,
-                    "distancia": distance
-                })
+    for pos in np.flatnonzero(comparable & (distances > threshold_meters)):
+        index = df.index[pos]
+        divergences.append({
+            "index": index,
+            "nome": names[pos] if names is not None else f'Ponto {index + 1}',
+            "coords_planilha": (float(lat[pos]), float(lon[pos])),
+            "coords_link": (float(link_lat[pos]), float(link_lon[pos])),
+            "distancia": int(distances[pos])
+        })
     return divergences
 
 # --- SEÇÃO 3: ORQUESTRADORES DE PROCESSAMENTO ---
@@ -184,14 +344,9 @@ def process_uploaded_file(uploaded_file: Any) -> Dict[str, Any]:
         file_content = uploaded_file.getvalue()
 
         if suffix == '.gpx': 
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".gpx") as tmp_file:
-                tmp_file.write(file_content)
-                file_path = tmp_file.name
-            df_raw = _parse_gpx_file(file_path)
-            os.remove(file_path)
+            df_raw = _parse_gpx_bytes(file_content)
         elif suffix == '.kml':
-            tree = etree.fromstring(file_content)
-            df_raw = _parse_kml_tree(etree.ElementTree(tree))
+            df_raw = _parse_kml_bytes(file_content)
         elif suffix in ['.csv', '.xlsx']: 
             df_raw = _parse_csv_or_excel(file_content, is_excel=(suffix == '.xlsx'))
         else:
@@ -200,7 +355,7 @@ def process_uploaded_file(uploaded_file: Any) -> Dict[str, Any]:
         if df_raw.empty:
             return {'status': 'error', 'message': 'Nenhum dado encontrado no arquivo.'}
 
-        df_std = _auto_detect_and_standardize_columns(df_raw.copy())
+        df_std = _auto_detect_and_standardize_columns(df_raw)
         
         if 'Latitude' not in df_std.columns or 'Longitude' not in df_std.columns:
             if 'Link' in df_std.columns:
@@ -231,18 +386,18 @@ def process_uploaded_file(uploaded_file: Any) -> Dict[str, Any]:
 def process_mymaps_link(url: str) -> Dict[str, Any]:
     """Baixa e processa os pontos de um link do Google My Maps."""
     try:
-        mid_match = re.search(r"mid=([a-zA-Z0-9_-]+)", url)
+        mid_match = _MID_RE.search(url)
         if not mid_match:
             return {'status': 'error', 'message': 'URL do My Maps inválida. Verifique o link.'}
         
         mid = mid_match.group(1)
         kml_url = f"https://www.google.com/maps/d/kml?mid={mid}&forcekml=1"
         
-        response = requests.get(kml_url, headers={'User-Agent': 'Mozilla/5.0'}, timeout=10)
-        response.raise_for_status()
-
-        tree = etree.fromstring(response.content)
-        df = _parse_kml_tree(etree.ElementTree(tree))
+        with _SESSION.get(kml_url, headers={'User-Agent': 'Mozilla/5.0'}, stream=True, timeout=10) as response:
+            response.raise_for_status()
+            # Analisa o KML enquanto ele é baixado, sem guardar o corpo inteiro.
+            response.raw.decode_content = True
+            df = _parse_kml_stream(response.raw)
 
         if df.empty:
             return {'status': 'error', 'message': 'Nenhum ponto encontrado no mapa. Verifique se o mapa não está vazio e se está público.'}
@@ -256,22 +411,19 @@ def process_mymaps_link(url: str) -> Dict[str, Any]:
 def process_drive_link(url: str) -> Dict[str, Any]:
     """Baixa e processa um arquivo do Google Drive de forma robusta."""
     try:
-        file_id_match = re.search(r"/d/([a-zA-Z0-9_-]+)", url) or re.search(r"id=([a-zA-Z0-9_-]+)", url)
+        file_id_match = _DRIVE_D_RE.search(url) or _DRIVE_ID_RE.search(url)
         if not file_id_match:
             return {'status': 'error', 'message': 'URL do Google Drive inválida.'}
         
         file_id = file_id_match.group(1)
         
-        session = requests.Session()
-        session.headers.update({'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'})
-        
         if "/spreadsheets/" in url:
             download_url = f'https://docs.google.com/spreadsheets/d/{file_id}/export?format=csv'
-            response = session.get(download_url, stream=True, timeout=15)
+            response = _SESSION.get(download_url, headers=_DRIVE_HEADERS, stream=True, timeout=15)
             is_excel = False
         else:
             download_url = f'https://drive.google.com/uc?export=download&id={file_id}'
-            response = session.get(download_url, stream=True, timeout=15)
+            response = _SESSION.get(download_url, headers=_DRIVE_HEADERS, stream=True, timeout=15)
             
             token = None
             for key, value in response.cookies.items():
@@ -281,7 +433,9 @@ def process_drive_link(url: str) -> Dict[str, Any]:
             
             if token:
                 params = {'id': file_id, 'export': 'download', 'confirm': token}
-                response = session.get('https://drive.google.com/uc', params=params, stream=True, timeout=15)
+                # A sessão não guarda cookies; o aviso do Drive é reenviado explicitamente.
+                response = _SESSION.get('https://drive.google.com/uc', params=params, headers=_DRIVE_HEADERS,
+                                        cookies=response.cookies, stream=True, timeout=15)
             
             content_type = response.headers.get('Content-Type', '')
             is_excel = "spreadsheet" in content_type or "excel" in content_type
@@ -301,7 +455,7 @@ def process_drive_link(url: str) -> Dict[str, Any]:
         if df_raw.empty:
             return {'status': 'error', 'message': 'O arquivo do Drive está vazio ou em formato não reconhecido.'}
         
-        df_std = _auto_detect_and_standardize_columns(df_raw.copy())
+        df_std = _auto_detect_and_standardize_columns(df_raw)
         if 'Latitude' not in df_std.columns or 'Longitude' not in df_std.columns:
             if 'Link' in df_std.columns:
                 df_std['coords_from_link'] = df_std['Link'].astype(str).apply(extract_coords_from_text)
@@ -332,13 +486,18 @@ def process_raw_text(text_data: str) -> Dict[str, Any]:
         if df_raw.empty:
             return {'status': 'error', 'message': 'O texto está em formato não reconhecido.'}
 
-        df_std = _auto_detect_and_standardize_columns(df_raw.copy())
+        df_std = _auto_detect_and_standardize_columns(df_raw)
         
         if 'Latitude' not in df_std.columns or 'Longitude' not in df_std.columns:
             for col in df_std.columns:
-                coords_series = df_std[col].dropna().astype(str).apply(extract_coords_from_text)
-                if coords_series.count() / len(df_std[col].dropna()) > 0.5:
-                    coords_df = pd.DataFrame(coords_series.dropna().tolist(), index=coords_series.dropna().index, columns=['Latitude', 'Longitude'])
+                # Uma coluna numérica guarda um número por célula, nunca um par de coordenadas.
+                if pd.api.types.is_numeric_dtype(df_std[col]):
+                    continue
+                values = df_std[col].dropna()
+                if values.empty:
+                    continue
+                coords_df = extract_coords_from_series(values).dropna()
+                if len(coords_df) / len(values) > 0.5:
                     df_std = df_std.join(coords_df)
                     if 'Nome' not in df_std.columns:
                         try:
@@ -363,18 +522,85 @@ def extract_coords_from_text(text: str) -> Optional[Tuple[float, float]]:
     Aceita links do Google Maps e vários formatos de texto.
     """
     if not isinstance(text, str): return None
-    
-    text_cleaned = text.strip()
-    
-    if "maps.app.goo.gl" in text_cleaned:
-        try:
-            response = requests.head(text_cleaned, allow_redirects=True, timeout=5)
-            text_cleaned = response.url
-        except requests.RequestException:
-            pass
+    text = text.strip()
+    # O link encurtado é resolvido fora do cache de extração: se a rede falhar,
+    # nada é memorizado e uma nova tentativa pode dar certo.
+    if "maps.app.goo.gl" in text:
+        text = _resolve_short_url(text)
+        if text is None:
+            return None
+    return _extract_coords_cached(text)
+
+def extract_coords_from_series(series: pd.Series) -> pd.DataFrame:
+    """
+    Versão vetorizada de `extract_coords_from_text` para uma coluna inteira.
+    O caso comum (dois números decimais no texto) é resolvido com o acessor
+    `.str` do pandas; links encurtados e textos em que esse caso não produz uma
+    coordenada válida seguem pela função completa, linha a linha.
+
+    Returns:
+        pd.DataFrame: Colunas 'Latitude' e 'Longitude' com o mesmo índice da
+                      série de entrada (NaN onde nada foi encontrado).
+    """
+    text = series.astype(str)
+    cleaned = text.str.replace(_CLEAN_RE, "", regex=True)
+    pairs = cleaned.str.extract(_PAIR_RE).astype(float)
+    first, second = pairs[0], pairs[1]
+
+    straight = first.between(-90, 90) & second.between(-180, 180)
+    swapped = ~straight & second.between(-90, 90) & first.between(-180, 180)
+    coords = pd.DataFrame({
+        'Latitude': first.where(straight, second.where(swapped)),
+        'Longitude': second.where(straight, first.where(swapped)),
+    }, index=series.index)
+
+    short_links = text.str.contains("maps.app.goo.gl", regex=False)
+    # Todos os formatos aceitos exigem um número decimal no texto limpo; células
+    # sem nenhum (nomes, endereços) não têm por que passar pela função completa.
+    has_decimal = cleaned.str.contains(DECIMAL_RE)
+    fallback = (coords['Latitude'].isna() & has_decimal) | short_links
+    if fallback.any():
+        coords.loc[fallback] = np.nan
+        _prefetch_short_urls(text[short_links].str.strip().unique().tolist())
+        resolved = text[fallback].map(extract_coords_from_text).dropna()
+        if not resolved.empty:
+            coords.loc[resolved.index] = resolved.tolist()
+    return coords
+
+@functools.lru_cache(maxsize=4096)
+def _follow_short_url(url: str) -> str:
+    """
+    Segue os redirecionamentos de um link encurtado, memorizado por URL. Erros
+    de rede são propagados: o lru_cache não guarda exceções, só os sucessos.
+    """
+    return _SESSION.head(url, allow_redirects=True, timeout=5).url
 
-    text_cleaned = re.sub(r"[°'\"()NnSsOoWwEe]", "", text_cleaned)
-    numbers = re.findall(r"-?\d+\.\d+", text_cleaned)
+def _resolve_short_url(url: str) -> Optional[str]:
+    """URL final de um link encurtado, ou None se a resolução falhar."""
+    try:
+        return _follow_short_url(url)
+    except requests.RequestException as e:
+        print(f"ERRO ao resolver o link encurtado {url}: {e}")
+        return None
+
+def _prefetch_short_urls(urls: List[str]) -> None:
+    """
+    Resolve vários links encurtados distintos em paralelo, preenchendo o cache de
+    `_follow_short_url` antes do processamento linha a linha.
+    """
+    if len(urls) < 2:
+        return
+    with ThreadPoolExecutor(max_workers=min(SHORT_LINK_MAX_WORKERS, len(urls))) as executor:
+        list(executor.map(_resolve_short_url, urls))
+
+@functools.lru_cache(maxsize=4096)
+def _extract_coords_cached(text_cleaned: str) -> Optional[Tuple[float, float]]:
+    """
+    Implementação de extract_coords_from_text, memorizada pelo texto de entrada
+    (links encurtados já chegam resolvidos).
+    """
+    text_cleaned = _CLEAN_RE.sub("", text_cleaned)
+    numbers = DECIMAL_RE.findall(text_cleaned)
     
     if len(numbers) >= 2:
         try:
@@ -384,19 +610,19 @@ def extract_coords_from_text(text: str) -> Optional[Tuple[float, float]]:
         except (ValueError, IndexError):
             pass
 
-    at_match = re.search(r"@(-?\d+\.\d+),(-?\d+\.\d+)", text_cleaned)
+    at_match = _AT_RE.search(text_cleaned)
     if at_match:
         lat, lon = float(at_match.group(1)), float(at_match.group(2))
         if _validate_coordinates(lat, lon): return lat, lon
 
-    dir_match = re.findall(r"!2d(-?\d+\.\d+)!3d(-?\d+\.\d+)|!3d(-?\d+\.\d+)!4d(-?\d+\.\d+)", text_cleaned)
+    dir_match = _DIR_RE.findall(text_cleaned)
     if dir_match:
         for m in dir_match:
             lat, lon = (m[2], m[3]) if m[2] else (m[1], m[0])
             lat, lon = float(lat), float(lon)
             if _validate_coordinates(lat, lon): return lat, lon
 
-    q_match = re.search(r"\?q=(-?\d+\.\d+),(-?\d+\.\d+)", text_cleaned)
+    q_match = _Q_RE.search(text_cleaned)
     if q_match:
         lat, lon = float(q_match.group(1)), float(q_match.group(2))
         if _validate_coordinates(lat, lon): return lat, lon
@@ -1,14 +1,27 @@
 # src/exporter.py
 # Responsável por criar visualizações e exportar dados para diversos formatos.
-# VERSÃO 3.0.5: Código limpo, adicionados comentários detalhados e docstrings.
+# VERSÃO 3.0.9: KML e GPX montados como texto, sem lxml nem gpxpy.
 
 import pandas as pd
 import folium
-import json
-from lxml import etree
-import gpxpy
-from gpxpy.gpx import GPX, GPXWaypoint, GPXRoute, GPXRoutePoint
-from typing import Optional, Dict, List
+import orjson
+import io
+from xml.sax.saxutils import escape
+from typing import Optional, Dict, List, Tuple
+
+def _point_columns(df: pd.DataFrame) -> Tuple[list, list, list]:
+    """
+    Extrai latitudes, longitudes e nomes dos pontos como listas Python, uma vez
+    por exportação, em vez de montar uma Series por linha com `iterrows`.
+    Pontos sem coluna 'Nome' recebem "Ponto N" pela posição na rota.
+    """
+    lats = df['Latitude'].tolist()
+    lons = df['Longitude'].tolist()
+    if 'Nome' in df.columns:
+        names = df['Nome'].tolist()
+    else:
+        names = [f"Ponto {i + 1}" for i in range(len(df))]
+    return lats, lons, names
 
 # --- SEÇÃO 1: CRIAÇÃO DE MAPA INTERATIVO ---
 
@@ -27,19 +40,19 @@ def create_interactive_map(df: pd.DataFrame, route_geojson: Optional[Dict] = Non
     if df is None or df.empty:
         return None
 
+    lats, lons, names = _point_columns(df)
+
     # Centraliza o mapa no primeiro ponto da rota.
-    start_point = df.iloc[0]
-    map_center = [start_point['Latitude'], start_point['Longitude']]
+    map_center = [lats[0], lons[0]]
     
     m = folium.Map(location=map_center, zoom_start=13, tiles="CartoDB positron")
 
     # Adiciona um marcador para cada ponto no DataFrame.
-    for index, row in df.iterrows():
-        point_name = row.get('Nome', f'Ponto {index + 1}')
+    for i, (lat, lon, point_name) in enumerate(zip(lats, lons, names)):
         folium.Marker(
-            location=[row['Latitude'], row['Longitude']],
-            popup=f"<b>{point_name}</b><br>Lat: {row['Latitude']:.5f}<br>Lon: {row['Longitude']:.5f}",
-            tooltip=f"{index + 1}: {point_name}"
+            location=[lat, lon],
+            popup=f"<b>{point_name}</b><br>Lat: {lat:.5f}<br>Lon: {lon:.5f}",
+            tooltip=f"{i + 1}: {point_name}"
         ).add_to(m)
 
     # Desenha a linha da rota no mapa.
@@ -52,7 +65,7 @@ def create_interactive_map(df: pd.DataFrame, route_geojson: Optional[Dict] = Non
         ).add_to(m)
     else:
         # Caso contrário, desenha uma linha reta pontilhada (rota offline).
-        locations = df[['Latitude', 'Longitude']].values.tolist()
+        locations = [[lat, lon] for lat, lon in zip(lats, lons)]
         folium.PolyLine(
             locations=locations,    
             color="#FF6347",    
@@ -67,92 +80,135 @@ def create_interactive_map(df: pd.DataFrame, route_geojson: Optional[Dict] = Non
 
 # --- SEÇÃO 2: FUNÇÕES DE EXPORTAÇÃO DE ARQUIVO ---
 
-def export_to_csv(df: pd.DataFrame) -> str:
-    """Converte o DataFrame para uma string no formato CSV."""
-    return df.to_csv(index=False, encoding='utf-8-sig')
+def _csv_bytes(df: pd.DataFrame) -> bytes:
+    """
+    Grava o CSV direto num buffer binário. Com um buffer o pandas aplica o
+    `encoding` (inclusive o BOM do 'utf-8-sig', que o Excel usa para ler os
+    acentos); ao retornar uma string, o encoding é ignorado.
+    """
+    buffer = io.BytesIO()
+    df.to_csv(buffer, index=False, encoding='utf-8-sig')
+    return buffer.getvalue()
+
+def export_to_csv(df: pd.DataFrame) -> bytes:
+    """Converte o DataFrame para um arquivo CSV em formato de bytes."""
+    return _csv_bytes(df)
 
-def export_to_geojson(df: pd.DataFrame) -> str:
-    """Converte os pontos e a rota para uma string no formato GeoJSON."""
-    features = []
+def export_to_geojson(df: pd.DataFrame) -> bytes:
+    """Converte os pontos e a rota para um arquivo GeoJSON em formato de bytes."""
+    lats, lons, names = _point_columns(df)
     # Cria uma "Feature" do tipo Ponto para cada linha do DataFrame.
-    for index, row in df.iterrows():
-        features.append({
+    features = [
+        {
             "type": "Feature",
-            "geometry": {"type": "Point", "coordinates": [row['Longitude'], row['Latitude']]},
-            "properties": {
-                "name": row.get('Nome', f"Ponto {index + 1}"),
-                "order": index + 1
-            }
-        })
+            "geometry": {"type": "Point", "coordinates": [lon, lat]},
+            "properties": {"name": name, "order": i + 1}
+        }
+        for i, (lat, lon, name) in enumerate(zip(lats, lons, names))
+    ]
     # Cria uma "Feature" do tipo LineString para representar a rota.
-    line_coordinates = df[['Longitude', 'Latitude']].values.tolist()
+    line_coordinates = [[lon, lat] for lat, lon in zip(lats, lons)]
     features.append({
         "type": "Feature",
         "geometry": {"type": "LineString", "coordinates": line_coordinates},
         "properties": {"name": "Rota Otimizada"}
     })
     geojson_output = {"type": "FeatureCollection", "features": features}
-    return json.dumps(geojson_output, indent=2)
+    return orjson.dumps(geojson_output, option=orjson.OPT_INDENT_2)
 
 def export_to_kml(df: pd.DataFrame) -> bytes:
-    """Converte os pontos e a rota para um arquivo KML em formato de bytes."""
-    kml_root = etree.Element("kml", nsmap={None: "http://www.opengis.net/kml/2.2"})
-    document = etree.SubElement(kml_root, "Document")
-    etree.SubElement(document, "name").text = "Rota Otimizada"
-    
+    """
+    Converte os pontos e a rota para um arquivo KML em formato de bytes.
+    O documento tem estrutura fixa, então é montado direto como texto; só os
+    nomes precisam de escape.
+    """
+    lats, lons, names = _point_columns(df)
+    coords = [f"{lon},{lat},0" for lat, lon in zip(lats, lons)]
+
+    parts = [
+        "<?xml version='1.0' encoding='utf-8'?>\n"
+        '<kml xmlns="http://www.opengis.net/kml/2.2">\n'
+        "  <Document>\n"
+        "    <name>Rota Otimizada</name>\n"
+    ]
     # Adiciona um Placemark para cada ponto.
-    for index, row in df.iterrows():
-        placemark = etree.SubElement(document, "Placemark")
-        etree.SubElement(placemark, "name").text = str(row.get('Nome', f"Ponto {index + 1}"))
-        point = etree.SubElement(placemark, "Point")
-        etree.SubElement(point, "coordinates").text = f"{row['Longitude']},{row['Latitude']},0"
-        
+    parts.extend(
+        "    <Placemark>\n"
+        f"      <name>{escape(str(name))}</name>\n"
+        "      <Point>\n"
+        f"        <coordinates>{coord}</coordinates>\n"
+        "      </Point>\n"
+        "    </Placemark>\n"
+        for name, coord in zip(names, coords)
+    )
     # Adiciona um Placemark para a linha da rota.
-    placemark_route = etree.SubElement(document, "Placemark")
-    etree.SubElement(placemark_route, "name").text = "Trajeto da Rota"
-    line_string = etree.SubElement(placemark_route, "LineString")
-    coords_text = " ".join([f"{row['Longitude']},{row['Latitude']},0" for _, row in df.iterrows()])
-    etree.SubElement(line_string, "coordinates").text = coords_text
-    
-    return etree.tostring(kml_root, pretty_print=True, xml_declaration=True, encoding='utf-8')
+    parts.append(
+        "    <Placemark>\n"
+        "      <name>Trajeto da Rota</name>\n"
+        "      <LineString>\n"
+        f"        <coordinates>{' '.join(coords)}</coordinates>\n"
+        "      </LineString>\n"
+        "    </Placemark>\n"
+        "  </Document>\n"
+        "</kml>\n"
+    )
+    return "".join(parts).encode("utf-8")
+
+def _gpx_number(value: float) -> str:
+    """Formata uma coordenada para o GPX, que não aceita notação científica."""
+    text = str(value)
+    if 'e' not in text:
+        return text
+    return format(value, '.10f').rstrip('0').rstrip('.')
 
 def export_to_gpx(df: pd.DataFrame) -> str:
-    """Converte os pontos (waypoints) e a rota para uma string no formato GPX."""
-    gpx = GPX()
-    
+    """
+    Converte os pontos (waypoints) e a rota para uma string no formato GPX,
+    montada direto como texto, como no KML.
+    """
+    lats, lons, names = _point_columns(df)
+    lats = [_gpx_number(lat) for lat in lats]
+    lons = [_gpx_number(lon) for lon in lons]
+
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<gpx xmlns="http://www.topografix.com/GPX/1/1" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+        'xsi:schemaLocation="http://www.topografix.com/GPX/1/1 http://www.topografix.com/GPX/1/1/gpx.xsd" '
+        'version="1.1" creator="Otimizador de Rotas">\n'
+    ]
     # Adiciona cada ponto como um Waypoint.
-    for index, row in df.iterrows():
-        gpx.waypoints.append(GPXWaypoint(
-            latitude=row['Latitude'],
-            longitude=row['Longitude'],
-            name=str(row.get('Nome', f"Ponto {index + 1}"))
-        ))
-        
+    parts.extend(
+        f'  <wpt lat="{lat}" lon="{lon}">\n'
+        f"    <name>{escape(str(name))}</name>\n"
+        "  </wpt>\n"
+        for lat, lon, name in zip(lats, lons, names)
+    )
     # Cria uma Rota que conecta todos os waypoints.
-    gpx_route = GPXRoute(name="Rota Otimizada")
-    gpx_route.points = [GPXRoutePoint(row['Latitude'], row['Longitude']) for _, row in df.iterrows()]
-    gpx.routes.append(gpx_route)
-    
-    return gpx.to_xml(prettyprint=True)
-
-def export_to_mymaps_csv(df: pd.DataFrame) -> str:
+    parts.append("  <rte>\n    <name>Rota Otimizada</name>\n")
+    parts.extend(
+        f'    <rtept lat="{lat}" lon="{lon}">\n    </rtept>\n'
+        for lat, lon in zip(lats, lons)
+    )
+    parts.append("  </rte>\n</gpx>")
+    return "".join(parts)
+
+def export_to_mymaps_csv(df: pd.DataFrame) -> bytes:
     """Formata o DataFrame para um CSV compatível com o Google My Maps."""
-    df_mymaps = df.copy()
-    
-    # Adiciona a coluna de ordem da rota, que é útil no My Maps.
-    df_mymaps.insert(0, 'Ordem', range(1, len(df_mymaps) + 1))
-    
     # Seleciona e reordena as colunas de interesse para o My Maps.
-    cols_to_keep = ['Ordem', 'Nome', 'Latitude', 'Longitude']
+    cols_to_keep = ['Nome', 'Latitude', 'Longitude']
     # Adiciona colunas extras se elas existirem (enriquecidas pela IA).
-    if 'Endereço' in df_mymaps.columns:
+    if 'Endereço' in df.columns:
         cols_to_keep.append('Endereço')
-    if 'Categoria' in df_mymaps.columns:
+    if 'Categoria' in df.columns:
         cols_to_keep.append('Categoria')
-        
-    df_mymaps = df_mymaps[cols_to_keep]
-    
-    return df_mymaps.to_csv(index=False, encoding='utf-8-sig')
+
+    # A seleção já gera um DataFrame novo; não é preciso copiar o original inteiro.
+    df_mymaps = df[cols_to_keep]
+
+    # Adiciona a coluna de ordem da rota, que é útil no My Maps.
+    df_mymaps.insert(0, 'Ordem', range(1, len(df_mymaps) + 1))
+
+    return _csv_bytes(df_mymaps)
 
 # --- SEÇÃO 3: GERAÇÃO DE LINKS EXTERNOS ---
 
@@ -167,6 +223,7 @@ def generate_google_maps_links(df: pd.DataFrame) -> List[str]:
     links = []
     base_url = "https://www.google.com/maps/dir/"
     num_points = len(df)
+    points = [f"{lat},{lon}" for lat, lon in zip(df['Latitude'].tolist(), df['Longitude'].tolist())]
     # O Google Maps aceita origem + 9 destinos, totalizando 10 pontos por link.
     chunk_size = 10 
 
@@ -174,11 +231,10 @@ def generate_google_maps_links(df: pd.DataFrame) -> List[str]:
     # O -1 no passo (step) garante a sobreposição, fazendo com que o fim de um
     # "pedaço" seja o começo do próximo, criando uma rota contínua.
     for i in range(0, num_points, chunk_size - 1):
-        chunk = df.iloc[i : i + chunk_size]
+        chunk = points[i : i + chunk_size]
         if len(chunk) < 2:
             continue # Pula o último ponto se ele ficar sozinho
             
-        points_str = "/".join([f"{row['Latitude']},{row['Longitude']}" for _, row in chunk.iterrows()])
-        links.append(base_url + points_str)
+        links.append(base_url + "/".join(chunk))
 
     return links
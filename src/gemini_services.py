@@ -1,50 +1,174 @@
 # src/gemini_services.py
 # Módulo para todas as interações com a API do Google Gemini.
-# VERSÃO 3.1.0: Refatoradas funções de IA para processamento em lote.
+# VERSÃO 3.1.18: Limitador de taxa movido para src.utils, compartilhado com a geocodificação do ORS.
 
 import google.generativeai as genai
+import numpy as np
 import pandas as pd
 import streamlit as st
 import json
+import orjson
 import time
 import math
+import random
+import hashlib
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterator, Optional, Tuple
+from google.api_core.exceptions import ResourceExhausted
 
-# Importa a função de cálculo de distância do nosso módulo de utilitários
-from src.utils import haversine_distance
+# Importa o cálculo vetorizado de distâncias e o limitador de taxa do nosso módulo de utilitários
+from src.utils import haversine_distances, RateLimiter
 # Importa as configurações centralizadas
-from src.config import GEMINI_MODEL_NAME
+from src.config import GEMINI_MODEL_NAME, GEMINI_MAX_WORKERS, GEMINI_CACHE_TTL, GEMINI_RPM
+from src.cache import DiskCache
 
 # --- CONFIGURAÇÃO E FUNÇÕES AUXILIARES ---
 
 # Define um tamanho de lote para as chamadas de API
 BATCH_SIZE = 10
+ENRICH_BATCH_ERROR = "Erro na busca em lote"  # Valor gravado nos pontos de um lote que falhou
+DUPLICATE_BATCH_SIZE = 20  # Pares por prompt na verificação de duplicatas
+DUPLICATE_GROUPS_PER_BATCH = 10  # Grupos de pontos próximos por prompt
+DUPLICATE_MAX_GROUP_SIZE = 30  # Grupos maiores voltam à verificação par a par
+
+# Respostas já obtidas, pela hash do modelo + prompt: o mesmo prompt (mesmos
+# pontos) não volta a custar uma chamada à API, mesmo após reiniciar o app.
+_GEMINI_CACHE = DiskCache("gemini")
+_CACHE_STATS = {"hits": 0, "misses": 0}
+_CACHE_STATS_LOCK = threading.Lock()
+
+_RATE_LIMITER = RateLimiter(GEMINI_RPM)
+
+def _count_cache(outcome: str):
+    """Conta um acerto ("hits") ou uma falta ("misses") do cache de respostas."""
+    with _CACHE_STATS_LOCK:
+        _CACHE_STATS[outcome] += 1
+
+def _point_cache_key(task: str, *parts) -> str:
+    """
+    Chave do cache por ponto: as partes são normalizadas (minúsculas, espaços
+    simples) para que variações triviais do mesmo ponto reaproveitem a resposta.
+    """
+    normalized = "|".join(" ".join(str(part).lower().split()) for part in parts)
+    return f"{task}|" + hashlib.sha256(f"{GEMINI_MODEL_NAME}|{normalized}".encode("utf-8")).hexdigest()
+
+def _split_cached(keys: Dict) -> Tuple[Dict, Dict[object, list]]:
+    """
+    Separa os índices já respondidos no cache por ponto dos que ainda precisam
+    da API. Os pendentes vêm agrupados pela chave: só o primeiro índice de cada
+    grupo vai no prompt, e a resposta dele vale para todos os índices do grupo.
+    """
+    cached, groups, values = {}, {}, {}
+    for idx, key in keys.items():
+        if key in groups:
+            groups[key].append(idx)
+            continue
+        if key not in values:
+            values[key] = _GEMINI_CACHE.get(key)
+            if values[key] is not None:
+                _count_cache("hits")
+        if values[key] is None:
+            groups[key] = [idx]
+        else:
+            cached[idx] = values[key]
+    pending = {members[0]: members for members in groups.values()}
+    return cached, pending
+
+def get_gemini_cache_stats() -> Dict[str, int]:
+    """Retorna quantas respostas vieram do cache e quantas exigiram a API, desde o início do processo."""
+    with _CACHE_STATS_LOCK:
+        return dict(_CACHE_STATS)
+
+# Chave com que genai.configure foi chamado por último. A configuração é
+# global ao processo, então só precisa ser refeita quando a chave muda.
+_CONFIGURED_KEY: Optional[str] = None
+_CONFIGURE_LOCK = threading.Lock()
 
 def configure_gemini(api_key: str) -> bool:
     """
     Configura a API do Gemini com a chave fornecida.
     """
+    global _CONFIGURED_KEY
     try:
         if not api_key:
             print("ERRO: A chave da API do Gemini não foi fornecida.")
             return False
-        genai.configure(api_key=api_key)
+        with _CONFIGURE_LOCK:
+            if _CONFIGURED_KEY != api_key:
+                genai.configure(api_key=api_key)
+                _CONFIGURED_KEY = api_key
         return True
     except Exception as e:
         print(f"ERRO: Falha ao configurar a API do Gemini: {e}")
         return False
 
-def _call_gemini_api(prompt: str, api_key: str, retries: int = 3, delay: int = 5) -> str:
+@functools.lru_cache(maxsize=4)
+def _get_model(api_key: str):
+    """
+    Modelo do Gemini reaproveitado entre chamadas. A chave entra no cache
+    porque o cliente do modelo guarda a configuração vigente ao ser criado.
+    """
+    return genai.GenerativeModel(GEMINI_MODEL_NAME)
+
+def _dumps(data) -> str:
+    """Serializa os dados de um prompt em JSON compacto (sem indentação, menos tokens)."""
+    return orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY).decode("utf-8")
+
+def _loads(text: str):
+    """Decodifica uma resposta JSON; o json padrão fica como reserva para o que o orjson recusa (ex.: NaN)."""
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        return json.loads(text)
+
+MAX_RETRY_DELAY = 60  # Segundos; teto da espera entre retentativas
+
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    """
+    Lê o tempo de espera sugerido pela API (RetryInfo.retry_delay) num erro de
+    cota. Os detalhes chegam como protobuf (gRPC) ou como dicionário (REST).
+    Retorna None quando o erro não traz a sugestão.
+    """
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after:
+        return float(retry_after)
+    for detail in getattr(error, "details", None) or []:
+        if isinstance(detail, dict):
+            value = detail.get("retryDelay") or detail.get("retry_delay")
+            if isinstance(value, str) and value.endswith("s"):
+                try:
+                    return float(value[:-1])
+                except ValueError:
+                    continue
+        elif hasattr(detail, "retry_delay"):
+            return detail.retry_delay.seconds + detail.retry_delay.nanos / 1e9
+    return None
+
+def _call_gemini_api(prompt: str, api_key: str, retries: int = 3, delay: float = 1.5) -> str:
     """
     Função centralizada e robusta para chamar a API do Gemini.
-    Implementa retentativas em caso de falha.
+    Implementa retentativas em caso de falha (a espera sugerida pela API quando
+    a cota é excedida; senão, backoff exponencial com jitter a partir de
+    `delay` segundos) e respeita o limite de GEMINI_RPM. Respostas JSON
+    válidas ficam no cache em disco, então um prompt repetido não chama a API de novo.
     """
+    cache_key = hashlib.sha256(f"{GEMINI_MODEL_NAME}|{prompt}".encode("utf-8")).hexdigest()
+    cached = _GEMINI_CACHE.get(cache_key)
+    if cached is not None:
+        _count_cache("hits")
+        return cached
+    _count_cache("misses")
+
     if not configure_gemini(api_key):
         raise ConnectionError("Falha ao configurar a API do Gemini. Verifique a chave.")
 
-    model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+    model = _get_model(api_key)
     
     for attempt in range(retries):
         try:
+            _RATE_LIMITER.acquire()
             response = model.generate_content(prompt)
             # Limpeza aprimorada para extrair o JSON de dentro do texto de resposta
             json_text = response.text.strip()
@@ -53,50 +177,64 @@ def _call_gemini_api(prompt: str, api_key: str, retries: int = 3, delay: int = 5
             if json_text.endswith("```"):
                 json_text = json_text[:-3]
             json_text = json_text.strip()
+            try:
+                _loads(json_text)
+                _GEMINI_CACHE.set(cache_key, json_text, expire=GEMINI_CACHE_TTL)
+            except ValueError:
+                pass  # Resposta malformada: não vai para o cache.
             return json_text
         except Exception as e:
-            print(f"ERRO na API do Gemini (tentativa {attempt + 1}/{retries}): {e}")
-            if attempt < retries - 1:
-                time.sleep(delay)
-            else:
+            if attempt == retries - 1:
+                print(f"ERRO na API do Gemini (tentativa {attempt + 1}/{retries}): {e}")
                 raise
+            wait = _retry_after_seconds(e) if isinstance(e, ResourceExhausted) else None
+            if wait is None:
+                # Espera crescente e aleatória, para as threads não voltarem todas ao mesmo tempo.
+                wait = min(MAX_RETRY_DELAY, delay * 2 ** attempt) * random.uniform(0.5, 1.5)
+            wait = min(wait, MAX_RETRY_DELAY)
+            print(f"ERRO na API do Gemini (tentativa {attempt + 1}/{retries}): {e}. Nova tentativa em {wait:.1f}s.")
+            time.sleep(wait)
 
-# --- FUNÇÕES DE IA PARA A APLICAÇÃO ---
+def _call_gemini_json(prompt: str, api_key: str):
+    """Chama a API do Gemini e decodifica a resposta JSON."""
+    return _loads(_call_gemini_api(prompt, api_key))
 
-def enrich_data_with_gemini(df: pd.DataFrame, api_key: str) -> pd.DataFrame:
+def _run_batches(
+    df: pd.DataFrame, build_prompt: Callable[[pd.DataFrame], str], api_key: str,
+    batch_size: int = BATCH_SIZE
+) -> Iterator[Tuple[pd.DataFrame, Optional[list], Optional[Exception]]]:
     """
-    Usa a IA do Gemini para adicionar informações de endereço e categoria aos pontos em lotes.
+    Divide o DataFrame em lotes de `batch_size` linhas e envia os prompts ao Gemini em
+    paralelo (até GEMINI_MAX_WORKERS chamadas simultâneas). Entrega, na ordem em
+    que terminam, (lote, resposta decodificada, erro); o chamador aplica os
+    resultados e atualiza a interface na thread do script.
     """
-    df_copy = df.copy()
-    if 'Endereço' not in df_copy.columns:
-        df_copy['Endereço'] = ""
-    if 'Categoria' not in df_copy.columns:
-        df_copy['Categoria'] = ""
-
-    total_rows = len(df_copy)
-    progress_bar = st.progress(0, text="A IA está a enriquecer os seus dados (em lotes)...")
+    batches = [df.iloc[i:i+batch_size] for i in range(0, len(df), batch_size)]
+    if not batches:
+        return
+    with ThreadPoolExecutor(max_workers=min(GEMINI_MAX_WORKERS, len(batches)), thread_name_prefix="gemini") as executor:
+        futures = {
+            executor.submit(_call_gemini_json, build_prompt(batch), api_key): batch
+            for batch in batches
+        }
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                yield batch, future.result(), None
+            except Exception as e:
+                yield batch, None, e
 
-    for i in range(0, total_rows, BATCH_SIZE):
-        batch = df_copy.iloc[i:i+BATCH_SIZE]
-
-        # Cria uma lista de dicionários para o prompt
-        points_to_process = []
-        for index, row in batch.iterrows():
-            points_to_process.append({
-                "id": index,
-                "nome": row['Nome'],
-                "latitude": row['Latitude'],
-                "longitude": row['Longitude']
-            })
+# --- FUNÇÕES DE IA PARA A APLICAÇÃO ---
 
-        try:
-            prompt = f"""
+# Textos fixos dos prompts, definidos uma vez; só o JSON do lote é preenchido
+# com str.format (por isso as chaves literais do exemplo vão dobradas).
+_ENRICH_TEMPLATE = """
             Analise a lista de locais JSON a seguir. Para cada local, forneça o endereço
             completo mais provável e uma categoria (Ex: Serviço Público, Comércio,
             Ponto Turístico, Residencial, Outro).
 
             Locais:
-            {json.dumps(points_to_process, indent=2)}
+            {locais}
 
             Responda APENAS com um array JSON, onde cada objeto contém o "id" original,
             e as chaves "endereco" e "categoria" que você encontrou.
@@ -114,52 +252,77 @@ def enrich_data_with_gemini(df: pd.DataFrame, api_key: str) -> pd.DataFrame:
               }}
             ]
             """
-            json_text = _call_gemini_api(prompt, api_key)
-            results = json.loads(json_text)
-            
+
+def _enrich_prompt(batch: pd.DataFrame) -> str:
+    """Monta o prompt de enriquecimento (endereço e categoria) de um lote."""
+    # Cria uma lista de dicionários para o prompt
+    points_to_process = [
+        {"id": index, "nome": name, "latitude": lat, "longitude": lon}
+        for index, name, lat, lon in batch[['Nome', 'Latitude', 'Longitude']].itertuples(index=True, name=None)
+    ]
+
+    return _ENRICH_TEMPLATE.format(locais=_dumps(points_to_process))
+
+def enrich_data_with_gemini(df: pd.DataFrame, api_key: str) -> pd.DataFrame:
+    """
+    Usa a IA do Gemini para adicionar informações de endereço e categoria aos pontos em lotes.
+    """
+    # Só as colunas alteradas são montadas de novo; o DataFrame recebido não é
+    # copiado nem modificado.
+    addresses = df['Endereço'].copy() if 'Endereço' in df.columns else pd.Series("", index=df.index)
+    categories = df['Categoria'].copy() if 'Categoria' in df.columns else pd.Series("", index=df.index)
+
+    total_rows = len(df)
+    progress_bar = st.progress(0, text="A IA está a enriquecer os seus dados (em lotes)...")
+
+    # Pontos já enriquecidos antes (mesmo nome e coordenadas a ~10 m) vêm do cache;
+    # só os demais são enviados ao Gemini.
+    keys = {
+        idx: _point_cache_key("enrich", name, f"{lat:.4f}", f"{lon:.4f}")
+        for idx, name, lat, lon in zip(df.index, df['Nome'], df['Latitude'], df['Longitude'])
+    }
+    cached, pending = _split_cached(keys)
+    # (endereço, categoria) por índice; gravados no DataFrame de uma só vez no final.
+    updates = {idx: tuple(value) for idx, value in cached.items()}
+
+    processed_count = len(cached)
+    for batch, results, error in _run_batches(df.loc[list(pending)], _enrich_prompt, api_key):
+        try:
+            if error is not None:
+                raise error
+            answered = {}
             for result in results:
                 idx = result.get("id")
-                if idx is not None and idx in df_copy.index:
-                    df_copy.at[idx, 'Endereço'] = result.get("endereco", "Não encontrado")
-                    df_copy.at[idx, 'Categoria'] = result.get("categoria", "Não definida")
-            
+                if idx is not None and idx in pending:
+                    answered[idx] = (result.get("endereco", "Não encontrado"), result.get("categoria", "Não definida"))
+                    updates.update(dict.fromkeys(pending[idx], answered[idx]))
+            for idx, value in answered.items():
+                _GEMINI_CACHE.set(keys[idx], list(value), expire=GEMINI_CACHE_TTL)
         except Exception as e:
-            print(f"ERRO ao enriquecer o lote a partir do índice {i}: {e}")
+            print(f"ERRO ao enriquecer o lote a partir do índice {batch.index[0]}: {e}")
             # Em caso de erro no lote, marca todos os itens do lote como erro
             for index in batch.index:
-                df_copy.at[index, 'Endereço'] = "Erro na busca em lote"
-                df_copy.at[index, 'Categoria'] = "Erro na busca em lote"
-        
-        processed_count = min(i + BATCH_SIZE, total_rows)
+                updates.update(dict.fromkeys(pending[index], (ENRICH_BATCH_ERROR, ENRICH_BATCH_ERROR)))
+
+        processed_count += sum(len(pending[index]) for index in batch.index)
         progress_bar.progress(processed_count / total_rows, text=f"Processando: {processed_count}/{total_rows} pontos")
 
+    if updates:
+        labels = list(updates)
+        addresses.loc[labels] = [address for address, _ in updates.values()]
+        categories.loc[labels] = [category for _, category in updates.values()]
+
     progress_bar.empty()
     st.success("Dados enriquecidos com sucesso!")
-    return df_copy
+    return df.assign(**{'Endereço': addresses, 'Categoria': categories})
 
-def standardize_names_with_gemini(df: pd.DataFrame, api_key: str) -> pd.DataFrame:
-    """
-    Usa a IA do Gemini para padronizar os nomes dos locais em lotes.
-    """
-    df_copy = df.copy()
-    total_rows = len(df_copy)
-    progress_bar = st.progress(0, text="A IA está a padronizar os nomes (em lotes)...")
-
-    for i in range(0, total_rows, BATCH_SIZE):
-        batch = df_copy.iloc[i:i+BATCH_SIZE]
-
-        names_to_process = []
-        for index, row in batch.iterrows():
-            names_to_process.append({"id": index, "nome_original": row['Nome']})
-
-        try:
-            prompt = f"""
+_STANDARDIZE_TEMPLATE = """
             Analise a lista de nomes de locais a seguir. Para cada um, padronize o nome para
             um formato completo e oficial, corrigindo erros de digitação e expandindo
             abreviações (como Av. para Avenida, R. para Rua).
 
             Nomes:
-            {json.dumps(names_to_process, indent=2)}
+            {nomes}
 
             Responda APENAS com um array JSON, onde cada objeto contém o "id" original
             e a chave "nome_padronizado".
@@ -175,63 +338,278 @@ def standardize_names_with_gemini(df: pd.DataFrame, api_key: str) -> pd.DataFram
               }}
             ]
             """
-            json_text = _call_gemini_api(prompt, api_key)
-            results = json.loads(json_text)
 
+def _standardize_prompt(batch: pd.DataFrame) -> str:
+    """Monta o prompt de padronização de nomes de um lote."""
+    names_to_process = [
+        {"id": index, "nome_original": name}
+        for index, name in batch['Nome'].items()
+    ]
+
+    return _STANDARDIZE_TEMPLATE.format(nomes=_dumps(names_to_process))
+
+def standardize_names_with_gemini(df: pd.DataFrame, api_key: str) -> pd.DataFrame:
+    """
+    Usa a IA do Gemini para padronizar os nomes dos locais em lotes.
+    """
+    total_rows = len(df)
+    progress_bar = st.progress(0, text="A IA está a padronizar os nomes (em lotes)...")
+
+    # Nomes já padronizados antes vêm do cache; só os demais são enviados ao Gemini.
+    keys = {idx: _point_cache_key("nome", name) for idx, name in zip(df.index, df['Nome'])}
+    cached, pending = _split_cached(keys)
+    # Novo nome por índice; gravados no DataFrame de uma só vez no final.
+    updates = dict(cached)
+
+    processed_count = len(cached)
+    for batch, results, error in _run_batches(df.loc[list(pending)], _standardize_prompt, api_key):
+        try:
+            if error is not None:
+                raise error
             for result in results:
                 idx = result.get("id")
                 standardized_name = result.get("nome_padronizado")
-                if idx is not None and standardized_name and idx in df_copy.index:
-                    df_copy.at[idx, 'Nome'] = standardized_name
-                
+                if idx is not None and standardized_name and idx in pending:
+                    updates.update(dict.fromkeys(pending[idx], standardized_name))
+                    _GEMINI_CACHE.set(keys[idx], standardized_name, expire=GEMINI_CACHE_TTL)
         except Exception as e:
-            print(f"ERRO ao padronizar o lote a partir do índice {i}: {e}")
+            print(f"ERRO ao padronizar o lote a partir do índice {batch.index[0]}: {e}")
 
-        processed_count = min(i + BATCH_SIZE, total_rows)
+        processed_count += sum(len(pending[index]) for index in batch.index)
         progress_bar.progress(processed_count / total_rows, text=f"Padronizando: {processed_count}/{total_rows} nomes")
 
+    if updates:
+        # Só a coluna de nomes é nova; o DataFrame recebido não é copiado nem modificado.
+        names = df['Nome'].copy()
+        names.loc[list(updates)] = list(updates.values())
+        df = df.assign(Nome=names)
+
     progress_bar.empty()
     st.success("Nomes padronizados com sucesso!")
-    return df_copy
+    return df
+
+
+DUPLICATE_MAX_DISTANCE = 100  # Metros; só pares mais próximos que isso vão para a IA
+
+def _nearby_pairs(latitudes, longitudes, max_distance: int = DUPLICATE_MAX_DISTANCE) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Retorna os pares (i, j), com i < j, de pontos a menos de `max_distance`
+    metros, e a distância de cada par.
+
+    Os pontos são distribuídos numa grade de células com pouco mais de
+    `max_distance` de lado; só pontos da mesma célula ou de células vizinhas
+    são comparados. Assim o tempo e a memória crescem com N e com o número de
+    vizinhos, e não com N², como numa matriz de todas as distâncias.
+    """
+    R = 6371000  # Raio da Terra em metros
+
+    lat = np.asarray(latitudes, dtype=np.float64)
+    lon = np.asarray(longitudes, dtype=np.float64)
+    valid = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+    empty = np.empty(0, dtype=np.int64)
+    if len(valid) < 2:
+        return empty, empty, empty
+
+    # Lado da célula em graus, com 1% de folga. Na longitude o lado cresce com
+    # a latitude mais afastada do equador, para nenhum par próximo ficar a
+    # mais de uma célula de distância.
+    cell_lat = math.degrees(max_distance / R) * 1.01
+    max_abs_lat = min(float(np.abs(lat[valid]).max()), 89.0)
+    cell_lon = cell_lat / math.cos(math.radians(max_abs_lat))
+
+    cells = pd.DataFrame({
+        "point": valid,
+        "cy": np.floor(lat[valid] / cell_lat).astype(np.int64),
+        "cx": np.floor(lon[valid] / cell_lon).astype(np.int64),
+    })
+
+    # Metade da vizinhança (a própria célula e 4 das 8 vizinhas): cada par de
+    # células é visitado uma única vez.
+    candidates = []
+    for dy, dx in ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1)):
+        shifted = cells.assign(cy=cells["cy"] + dy, cx=cells["cx"] + dx)
+        joined = shifted.merge(cells, on=["cy", "cx"], suffixes=("_a", "_b"))
+        a, b = joined["point_a"].to_numpy(), joined["point_b"].to_numpy()
+        if (dy, dx) == (0, 0):
+            keep = a < b
+            a, b = a[keep], b[keep]
+        candidates.append((np.minimum(a, b), np.maximum(a, b)))
+
+    i = np.concatenate([pair[0] for pair in candidates])
+    j = np.concatenate([pair[1] for pair in candidates])
+    dist = haversine_distances(lat[i], lon[i], lat[j], lon[j])
+    close = dist < max_distance
+    i, j, dist = i[close], j[close], dist[close]
+
+    order = np.lexsort((j, i))
+    return i[order], j[order], dist[order]
+
+def _connected_components(size: int, i: np.ndarray, j: np.ndarray) -> np.ndarray:
+    """
+    Rótulo do grupo de cada ponto no grafo de vizinhança (arestas i-j entre
+    pontos próximos). Pontos ligados por uma cadeia de vizinhos recebem o
+    mesmo rótulo, que é o menor índice do grupo.
+    """
+    parent = list(range(size))
+
+    def find(x: int) -> int:
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for a, b in zip(i.tolist(), j.tolist()):
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+    return np.array([find(x) for x in range(size)], dtype=np.int64)
 
+_DUPLICATE_GROUPS_TEMPLATE = """
+            Analise os grupos de pontos JSON a seguir. Os pontos de um mesmo grupo
+            estão a poucos metros uns dos outros. Em cada grupo, quais pontos
+            provavelmente se referem ao mesmo local do mundo real? Considere nomes similares.
+
+            Grupos:
+            {grupos}
+
+            Para cada grupo retorne um objeto com o "grupo" original e a chave "clusters":
+            uma lista de objetos com "ids" (os ids dos pontos que são o mesmo local,
+            pelo menos dois) e "reason" (string). Use uma lista vazia se não houver duplicatas.
+            Responda APENAS com um array JSON.
+            Exemplo de resposta:
+            [
+              {{
+                "grupo": 0,
+                "clusters": [
+                  {{"ids": [3, 7], "reason": "Mesmo nome com abreviação diferente, a poucos metros."}}
+                ]
+              }}
+            ]
+            """
+
+def _duplicate_groups_prompt(batch: pd.DataFrame) -> str:
+    """Monta o prompt que pede os agrupamentos de duplicatas de um lote de grupos de pontos próximos."""
+    groups_to_process = [
+        {"grupo": group["group_id"], "pontos": group["pontos"]}
+        for group in batch.to_dict("records")
+    ]
+
+    return _DUPLICATE_GROUPS_TEMPLATE.format(grupos=_dumps(groups_to_process))
+
+_DUPLICATE_PAIRS_TEMPLATE = """
+            Analise os pares de pontos JSON a seguir. Em cada par, os pontos "a" e "b"
+            estão a "distancia_m" metros um do outro. Eles provavelmente se referem
+            ao mesmo local do mundo real? Considere nomes similares.
+
+            Pares:
+            {pares}
+
+            Para cada par retorne um objeto com o "pair_id" original e as chaves
+            "is_duplicate" (boolean) e "reason" (string).
+            Responda APENAS com um array JSON.
+            Exemplo de resposta:
+            [
+              {{
+                "pair_id": 0,
+                "is_duplicate": true,
+                "reason": "Mesmo nome com abreviação diferente, a poucos metros."
+              }}
+            ]
+            """
+
+def _duplicates_prompt(batch: pd.DataFrame) -> str:
+    """Monta o prompt de verificação de um lote de pares de pontos próximos."""
+    pairs_to_process = [
+        {
+            "pair_id": pair["pair_id"],
+            "a": {"id": pair["a_id"], "nome": pair["a_nome"]},
+            "b": {"id": pair["b_id"], "nome": pair["b_nome"]},
+            "distancia_m": pair["distancia_m"]
+        }
+        for pair in batch.to_dict("records")
+    ]
+
+    return _DUPLICATE_PAIRS_TEMPLATE.format(pares=_dumps(pairs_to_process))
 
 @st.dialog("Análise de Duplicatas")
 def find_duplicates_with_gemini(df: pd.DataFrame, api_key: str):
     """
     Usa a IA do Gemini para encontrar pontos duplicados e mostra o resultado num diálogo.
     """
-    potential_duplicates = []
     df_copy = df.reset_index().rename(columns={'index': 'original_index'})
 
     with st.spinner("Verificando duplicatas com IA... Isso pode levar um tempo."):
-        # A lógica de comparação par a par é mantida, pois a criação de lotes aqui é mais complexa.
-        for i in range(len(df_copy)):
-            for j in range(i + 1, len(df_copy)):
-                point1 = df_copy.iloc[i]
-                point2 = df_copy.iloc[j]
-                
-                distance = haversine_distance(point1['Latitude'], point1['Longitude'], point2['Latitude'], point2['Longitude'])
-                
-                if distance < 100: # Apenas verifica pontos próximos
-                    try:
-                        prompt = f"""
-                        Analise os dois pontos a seguir:
-                        - Ponto A (índice {point1['original_index']}): "{point1['Nome']}"
-                        - Ponto B (índice {point2['original_index']}): "{point2['Nome']}"
-                        - Distância entre eles: {distance:.1f} metros
-
-                        Eles provavelmente se referem ao mesmo local do mundo real? Considere nomes similares.
-                        Responda APENAS com um objeto JSON contendo as chaves "is_duplicate" (boolean) e "reason" (string).
-                        """
-                        json_text = _call_gemini_api(prompt, api_key)
-                        data = json.loads(json_text)
-
-                        if data.get("is_duplicate"):
-                            potential_duplicates.append(
-                                f"**Pontos {point1['original_index']} e {point2['original_index']}**: \"{point1['Nome']}\" e \"{point2['Nome']}\".\n  - *Razão da IA: {data.get('reason')}*"
-                            )
-                    except Exception as e:
-                        print(f"Erro ao verificar duplicata entre {i} e {j}: {e}")
+        # Pré-filtro vetorizado: só os pares próximos vão para a IA. Pares ligados
+        # formam grupos (componentes conexos); cada grupo vai inteiro num prompt,
+        # DUPLICATE_GROUPS_PER_BATCH grupos por chamada, e a IA diz quais pontos
+        # de cada grupo são o mesmo local.
+        i, j, distance = _nearby_pairs(df_copy['Latitude'], df_copy['Longitude'])
+        original_ids = df_copy['original_index'].to_numpy()
+        names = df_copy['Nome'].to_numpy()
+        labels = _connected_components(len(df_copy), i, j)
+        sizes = np.bincount(labels, minlength=len(df_copy))
+
+        lats = df_copy['Latitude'].to_numpy(dtype=float).round(6)
+        lons = df_copy['Longitude'].to_numpy(dtype=float).round(6)
+
+        in_groups = np.flatnonzero((sizes[labels] >= 2) & (sizes[labels] <= DUPLICATE_MAX_GROUP_SIZE))
+        members = [positions.tolist() for _, positions in pd.Series(in_groups).groupby(labels[in_groups])]
+        groups = pd.DataFrame({
+            "group_id": np.arange(len(members)),
+            "pontos": [
+                [{"id": p, "nome": names[p], "latitude": float(lats[p]), "longitude": float(lons[p])} for p in positions]
+                for positions in members
+            ],
+        })
+
+        # Grupos grandes demais para um prompt continuam par a par.
+        large = sizes[labels[i]] > DUPLICATE_MAX_GROUP_SIZE
+        pairs = pd.DataFrame({
+            "pair_id": np.arange(len(i)),
+            "a_id": original_ids[i],
+            "a_nome": names[i],
+            "b_id": original_ids[j],
+            "b_nome": names[j],
+            "distancia_m": distance,
+        })[large]
+
+        # Achados por posição dos pontos, para listar na ordem da tabela.
+        found = {}
+        for batch, results, error in _run_batches(groups, _duplicate_groups_prompt, api_key, DUPLICATE_GROUPS_PER_BATCH):
+            try:
+                if error is not None:
+                    raise error
+                for result in results:
+                    group_id = result.get("grupo")
+                    if group_id not in batch.index:
+                        continue
+                    allowed = set(members[group_id])
+                    for cluster in result.get("clusters") or []:
+                        ids = sorted({p for p in cluster.get("ids", []) if isinstance(p, int) and p in allowed})
+                        if len(ids) < 2:
+                            continue
+                        points = ", ".join(str(original_ids[p]) for p in ids[:-1]) + f" e {original_ids[ids[-1]]}"
+                        labels_text = ", ".join(f"\"{names[p]}\"" for p in ids[:-1]) + f" e \"{names[ids[-1]]}\""
+                        found[tuple(ids)] = (
+                            f"**Pontos {points}**: {labels_text}.\n  - *Razão da IA: {cluster.get('reason')}*"
+                        )
+            except Exception as e:
+                print(f"Erro ao verificar o lote de duplicatas a partir do grupo {batch.index[0]}: {e}")
+
+        for batch, results, error in _run_batches(pairs, _duplicates_prompt, api_key, DUPLICATE_BATCH_SIZE):
+            try:
+                if error is not None:
+                    raise error
+                for result in results:
+                    pair_id = result.get("pair_id")
+                    if result.get("is_duplicate") and pair_id in batch.index:
+                        pair = batch.loc[pair_id]
+                        found[(int(i[pair_id]), int(j[pair_id]))] = (
+                            f"**Pontos {pair['a_id']} e {pair['b_id']}**: \"{pair['a_nome']}\" e \"{pair['b_nome']}\".\n  - *Razão da IA: {result.get('reason')}*"
+                        )
+            except Exception as e:
+                print(f"Erro ao verificar o lote de duplicatas a partir do par {batch.index[0]}: {e}")
+        potential_duplicates = [found[key] for key in sorted(found)]
 
     if not potential_duplicates:
         st.success("Nenhuma duplicata provável encontrada!")
@@ -1,18 +1,29 @@
 # src/optimizer.py
 # Responsável pela lógica de otimização de rotas offline com Google OR-Tools.
-# VERSÃO 3.0.2: Refatorado para usar a função haversine_distance do módulo utils.
+# VERSÃO 3.0.9: Tempo de busca exposto (search_time_limit) para o app avisar a espera.
 
+import numpy as np
 import pandas as pd
+from typing import List, Optional
 from ortools.constraint_solver import routing_enums_pb2
 from ortools.constraint_solver import pywrapcp
 
-# Importa a função de cálculo de distância do nosso módulo de utilitários
-from src.utils import haversine_distance
+# Importa a função de cálculo de distâncias do nosso módulo de utilitários
+from src.utils import haversine_matrix
+from src.config import OPTIMIZER_MAX_SECONDS, OPTIMIZER_SMALL_ROUTE, OPTIMIZER_SMALL_SOLUTION_LIMIT
 
-def ortools_optimizer(df: pd.DataFrame, start_node: int = 0, end_node: int = 0) -> pd.DataFrame:
+def search_time_limit(num_locations: int) -> int:
     """
-    Otimiza a rota usando o Google OR-Tools para resolver o Problema do 
-    Caixeiro Viajante (TSP).
+    Tempo de busca (em segundos) proporcional ao tamanho do problema: 1 s para
+    poucos pontos, crescendo até OPTIMIZER_MAX_SECONDS nas rotas grandes. O app
+    mostra esse valor enquanto a otimização roda.
+    """
+    return max(1, min(OPTIMIZER_MAX_SECONDS, int(0.05 * num_locations ** 1.3)))
+
+def solve_route_order(df: pd.DataFrame, start_node: int = 0, end_node: int = 0) -> Optional[List[int]]:
+    """
+    Resolve o Problema do Caixeiro Viajante (TSP) com o Google OR-Tools e
+    retorna apenas a ordem de visita dos pontos.
 
     Args:
         df (pd.DataFrame): DataFrame com os pontos a serem otimizados.
@@ -20,33 +31,30 @@ def ortools_optimizer(df: pd.DataFrame, start_node: int = 0, end_node: int = 0)
         end_node (int): O índice do ponto de chegada no DataFrame.
 
     Returns:
-        pd.DataFrame: Um novo DataFrame com os pontos na ordem otimizada.
-                      Retorna o DataFrame original se a otimização falhar.
+        Optional[List[int]]: As posições dos pontos no DataFrame, na ordem
+                             otimizada, ou None se nenhuma solução for encontrada.
     """
-    if len(df) <= 2:
-        # Não há pontos intermediários para otimizar, retorna a ordem original.
-        return df
-
-    coords = df[['Latitude', 'Longitude']].values.tolist()
-    num_locations = len(coords)
+    # Calcula todas as distâncias de uma vez, em metros inteiros.
+    distance_matrix = haversine_matrix(
+        df['Latitude'].to_numpy(), df['Longitude'].to_numpy(), dtype=np.float32
+    ).tolist()
+    num_locations = len(distance_matrix)
     num_vehicles = 1
 
     # Cria o gerenciador de índices e o modelo de roteamento.
     manager = pywrapcp.RoutingIndexManager(num_locations, num_vehicles, [start_node], [end_node])
     routing = pywrapcp.RoutingModel(manager)
 
-    # Cria e registra o "callback" de distância.
-    # Esta função interna será chamada pelo OR-Tools para saber a distância entre dois pontos.
-    def distance_callback(from_index, to_index):
-        """Retorna a distância entre dois nós usando a função haversine."""
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        lat1, lon1 = coords[from_node]
-        lat2, lon2 = coords[to_node]
-        # AQUI ESTÁ A MUDANÇA: Usando a função importada de utils.py
-        return haversine_distance(lat1, lon1, lat2, lon2)
-
-    transit_callback_index = routing.RegisterTransitCallback(distance_callback)
+    # Registra a matriz inteira no OR-Tools. O solver consulta as distâncias em
+    # C++, sem chamar uma função Python a cada arco avaliado na busca. Versões do
+    # OR-Tools sem RegisterTransitMatrix usam o callback Python equivalente.
+    if hasattr(routing, "RegisterTransitMatrix"):
+        transit_callback_index = routing.RegisterTransitMatrix(distance_matrix)
+    else:
+        def distance_callback(from_index: int, to_index: int) -> int:
+            """Retorna a distância entre dois nós da rota."""
+            return distance_matrix[manager.IndexToNode(from_index)][manager.IndexToNode(to_index)]
+        transit_callback_index = routing.RegisterTransitCallback(distance_callback)
 
     # Define o custo da viagem como sendo a nossa distância.
     routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
@@ -59,27 +67,56 @@ def ortools_optimizer(df: pd.DataFrame, start_node: int = 0, end_node: int = 0)
     search_parameters.local_search_metaheuristic = (
         routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
     )
-    search_parameters.time_limit.FromSeconds(5)
+    # O lns_time_limit fica no padrão (100 ms): ele limita cada subproblema da
+    # busca em vizinhança grande, não a espera total, que é o time_limit.
+    search_parameters.time_limit.FromSeconds(search_time_limit(num_locations))
+    search_parameters.log_search = False
+    if num_locations < OPTIMIZER_SMALL_ROUTE:
+        # Em rotas pequenas a busca local chega ao ótimo em poucas soluções;
+        # não há por que esperar o tempo todo.
+        search_parameters.solution_limit = OPTIMIZER_SMALL_SOLUTION_LIMIT
 
     # Executa a otimização.
     solution = routing.SolveWithParameters(search_parameters)
 
-    if solution:
-        # Extrai a ordem otimizada dos índices do resultado.
-        route_indices = []
-        index = routing.Start(0)
-        while not routing.IsEnd(index):
-            node_index = manager.IndexToNode(index)
-            route_indices.append(node_index)
-            index = solution.Value(routing.NextVar(index))
-        
-        # Adiciona o último nó (ponto final) que o loop não inclui.
-        route_indices.append(manager.IndexToNode(index))
-        
-        # Reordena o DataFrame original com base na lista de índices otimizada.
-        optimized_df = df.iloc[route_indices].reset_index(drop=True)
-        return optimized_df
-    else:
+    if not solution:
+        return None
+
+    # Extrai a ordem otimizada dos índices do resultado.
+    route_indices = []
+    index = routing.Start(0)
+    while not routing.IsEnd(index):
+        node_index = manager.IndexToNode(index)
+        route_indices.append(node_index)
+        index = solution.Value(routing.NextVar(index))
+    
+    # Adiciona o último nó (ponto final) que o loop não inclui.
+    route_indices.append(manager.IndexToNode(index))
+    return route_indices
+
+def ortools_optimizer(df: pd.DataFrame, start_node: int = 0, end_node: int = 0) -> pd.DataFrame:
+    """
+    Otimiza a rota usando o Google OR-Tools para resolver o Problema do 
+    Caixeiro Viajante (TSP).
+
+    Args:
+        df (pd.DataFrame): DataFrame com os pontos a serem otimizados.
+        start_node (int): O índice do ponto de partida no DataFrame.
+        end_node (int): O índice do ponto de chegada no DataFrame.
+
+    Returns:
+        pd.DataFrame: Um novo DataFrame com os pontos na ordem otimizada.
+                      Retorna o DataFrame original se a otimização falhar.
+                      O DataFrame de entrada nunca é modificado.
+    """
+    if len(df) <= 2:
+        # Não há pontos intermediários para otimizar, retorna a ordem original.
+        return df
+
+    route_indices = solve_route_order(df, start_node, end_node)
+    if route_indices is None:
         # Se não encontrar solução, retorna o DataFrame original.
         return df
 
+    # Reordena o DataFrame original com base na lista de índices otimizada.
+    return df.iloc[route_indices].reset_index(drop=True)
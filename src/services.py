@@ -1,54 +1,191 @@
 # src/services.py
 # Responsável por interagir com APIs externas, como o OpenRouteService (ORS).
-# VERSÃO 3.0.5: Adicionada verificação de NaN antes de chamar a API de otimização.
+# VERSÃO 3.0.27: Aquecimento da conexão disparado pelo app, não na importação, e com os proxies do ambiente.
 
+import hashlib
+import threading
+import numpy as np
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
 import pandas as pd
-from typing import Optional, Tuple, Dict, Any, List
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Optional, Tuple, Dict, Any, List, Callable
 
 # Importa as configurações centralizadas
-from src.config import ORS_BASE_URL
+from src.config import (
+    ORS_BASE_URL, ORS_MAX_WORKERS, ORS_GEOCODE_RPM, GEOCODE_CACHE_TTL, GEOCODE_MISS_CACHE_TTL,
+    AUTOCOMPLETE_CACHE_TTL, ROUTE_CACHE_TTL, AUTOCOMPLETE_PREFIX_MAX_RESULTS, AUTOCOMPLETE_PREFIX_ENTRIES,
+)
+from src.cache import DiskCache
+from src.utils import RateLimiter
+
+# Caches persistentes, compartilhados entre sessões e reinícios do app.
+_GEOCODE_CACHE = DiskCache("geocode")
+_AUTOCOMPLETE_CACHE = DiskCache("autocomplete")
+_ROUTE_CACHE = DiskCache("routes")
+_MISSING = object()
+
+# Sugestões recentes por texto normalizado (LRU em memória). Enquanto o usuário
+# continua digitando, um prefixo que trouxe poucas sugestões é refinado
+# localmente, sem nova chamada à API.
+_PREFIX_CACHE: "OrderedDict[str, List[str]]" = OrderedDict()
+_PREFIX_CACHE_LOCK = threading.Lock()
+
+# Sessão HTTP compartilhada: mantém a conexão TCP/TLS viva entre as chamadas.
+# O pool comporta uma conexão por thread de fundo, para nenhuma ser descartada.
+# Cota excedida (429) e falhas temporárias do servidor são repetidas com espera
+# crescente (0,3 s, 0,6 s, 1,2 s), respeitando o Retry-After. As chamadas POST do
+# ORS (otimização e rotas) não alteram estado no servidor e podem ser repetidas.
+_RETRY = Retry(
+    total=3, backoff_factor=0.3,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=frozenset({"GET", "POST"}),
+    raise_on_status=False,
+)
+# O requests já pede respostas comprimidas (Accept-Encoding: gzip, deflate), o
+# que encolhe bastante o GeoJSON das rotas; o corpo é decodificado com orjson.
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=ORS_MAX_WORKERS, max_retries=_RETRY))
+
+# Threads de fundo para chamadas que não devem bloquear a interface.
+_EXECUTOR = ThreadPoolExecutor(max_workers=ORS_MAX_WORKERS, thread_name_prefix="ors")
+
+# Ritmo das consultas de geocodificação: o tamanho do pool limita só quantas
+# seguem ao mesmo tempo, não quantas por minuto. Sem o limitador, uma lista
+# longa esgotaria a cota e os endereços válidos voltariam como não encontrados.
+_GEOCODE_LIMITER = RateLimiter(ORS_GEOCODE_RPM)
+
+def _warm_up_connection() -> None:
+    """
+    Abre a conexão com o ORS (DNS + handshake TLS). A resposta não importa e
+    falhas (ex.: sem internet) são ignoradas.
+
+    O HEAD vai direto ao pool do adaptador da sessão com `retries=False`: o
+    _RETRY da sessão repete erros de conexão para qualquer método, e sem
+    internet prenderia uma thread de `_EXECUTOR` por várias tentativas. Proxies
+    e certificados vêm do ambiente, como nas chamadas feitas pela sessão.
+    """
+    try:
+        request = _SESSION.prepare_request(requests.Request("HEAD", ORS_BASE_URL))
+        settings = _SESSION.merge_environment_settings(request.url, {}, None, None, None)
+        pool = _SESSION.get_adapter(request.url).get_connection_with_tls_context(
+            request, verify=settings["verify"], proxies=settings["proxies"]
+        )
+        pool.urlopen("HEAD", request.path_url, headers=request.headers, retries=False, timeout=3)
+    except (Urllib3HTTPError, OSError):
+        pass
+
+def warm_up_connection() -> None:
+    """
+    Agenda a abertura da conexão com o ORS numa thread de fundo, para que a
+    primeira ação do usuário já encontre uma conexão pronta no pool.
+    """
+    _EXECUTOR.submit(_warm_up_connection)
+
+def _normalize_query(text: str) -> str:
+    """Normaliza um texto de busca para ser usado como chave de cache."""
+    return text.strip().lower().rstrip(".,;:!? ")
+
+def _cache_key(text: str) -> str:
+    """Chave de tamanho fixo para o cache em disco: hash do texto normalizado."""
+    return hashlib.blake2b(_normalize_query(text).encode("utf-8"), digest_size=16).hexdigest()
+
+def _remember_suggestions(query: str, suggestions: List[str]) -> None:
+    """Guarda as sugestões de um texto normalizado no cache de prefixos."""
+    with _PREFIX_CACHE_LOCK:
+        _PREFIX_CACHE[query] = suggestions
+        _PREFIX_CACHE.move_to_end(query)
+        if len(_PREFIX_CACHE) > AUTOCOMPLETE_PREFIX_ENTRIES:
+            _PREFIX_CACHE.popitem(last=False)
+
+def _narrow_from_prefix(query: str) -> Optional[List[str]]:
+    """
+    Procura o maior prefixo de `query` já consultado. Se ele trouxe menos de
+    AUTOCOMPLETE_PREFIX_MAX_RESULTS sugestões, devolve as que contêm `query`.
+    Retorna None quando não há prefixo útil ou nenhuma sugestão sobrevive ao
+    filtro; nesse caso a API deve ser consultada.
+    """
+    with _PREFIX_CACHE_LOCK:
+        previous = None
+        for end in range(len(query) - 1, 2, -1):
+            previous = _PREFIX_CACHE.get(query[:end])
+            if previous is not None:
+                break
+    if not previous or len(previous) >= AUTOCOMPLETE_PREFIX_MAX_RESULTS:
+        return None
+    narrowed = [suggestion for suggestion in previous if query in suggestion.lower()]
+    return narrowed or None
+
+def _post_ors_cached(path: str, payload: Dict[str, Any], headers: Dict[str, str], timeout: int, required_key: str) -> Any:
+    """
+    Faz um POST ao ORS reaproveitando a resposta guardada em disco para o mesmo
+    corpo de requisição (mesmos pontos, na mesma ordem, e mesmo perfil). Só
+    respostas que contêm `required_key` vão para o cache.
+
+    O corpo é serializado uma única vez com orjson (arrays NumPy são aceitos
+    diretamente) e os mesmos bytes servem de chave do cache e de corpo do POST.
+    """
+    body = orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_SORT_KEYS)
+    cache_key = f"{path}|{hashlib.blake2b(body, digest_size=16).hexdigest()}"
+    cached = _ROUTE_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+
+    response = _SESSION.post(
+        f"{ORS_BASE_URL}{path}", data=body,
+        headers={**headers, "Content-Type": "application/json"}, timeout=timeout
+    )
+    response.raise_for_status()
+    result = orjson.loads(response.content)
+    if isinstance(result, dict) and required_key in result:
+        _ROUTE_CACHE.set(cache_key, result, expire=ROUTE_CACHE_TTL)
+    return result
 
 def optimize_route_online(df: pd.DataFrame, api_key: str, start_node: int = 0, end_node: int = 0) -> Optional[Dict[str, Any]]:
     """
     Otimiza uma rota usando a API do OpenRouteService.
+    O DataFrame de entrada não é modificado; a rota ordenada é um novo DataFrame.
     """
     try:
         # --- VERIFICAÇÃO DE SEGURANÇA ---
         # Garante que não há valores nulos (NaN) nas coordenadas antes de continuar.
-        df_valid = df.dropna(subset=['Latitude', 'Longitude'])
+        coords_frame = df[['Latitude', 'Longitude']]
+        df_valid = df.dropna(subset=['Latitude', 'Longitude']) if coords_frame.isna().to_numpy().any() else df
         if len(df_valid) < 2:
             print("ERRO: Pontos insuficientes para otimização após remover valores inválidos.")
             return None
 
-        coords = df_valid[["Longitude", "Latitude"]].values.tolist()
-        
+        # Linhas de um único array [lon, lat]; o orjson as serializa direto,
+        # sem criar uma lista Python por ponto.
+        coords = np.ascontiguousarray(df_valid[["Longitude", "Latitude"]].to_numpy(dtype=np.float64))
+
+        job_mask = np.ones(len(coords), dtype=bool)
+        job_mask[[start_node, end_node]] = False
         jobs = [
-            {"id": idx, "location": [lon, lat]}
-            for idx, (lon, lat) in enumerate(coords)
-            if idx != start_node and idx != end_node
+            {"id": int(idx), "location": coords[idx]}
+            for idx in np.flatnonzero(job_mask)
         ]
         vehicles = [{
             "id": 1, "profile": "driving-car",
             "start": coords[start_node], "end": coords[end_node]
         }]
         payload = {"jobs": jobs, "vehicles": vehicles}
-        headers = {"Authorization": api_key, "Content-Type": "application/json"}
+        headers = {"Authorization": api_key}
 
-        opt_response = requests.post(f"{ORS_BASE_URL}/optimization", json=payload, headers=headers, timeout=30)
-        opt_response.raise_for_status()
-        opt_result = opt_response.json()
+        opt_result = _post_ors_cached("/optimization", payload, headers, 30, required_key="routes")
 
         steps = opt_result["routes"][0]["steps"]
         ordered_job_indices = [s["id"] for s in steps if s['type'] == 'job']
         final_route_indices = [start_node] + ordered_job_indices + [end_node]
         ordered_df = df_valid.iloc[final_route_indices].reset_index(drop=True)
 
-        dir_payload = {"coordinates": ordered_df[["Longitude", "Latitude"]].values.tolist()}
-        dir_response = requests.post(f"{ORS_BASE_URL}/v2/directions/driving-car/geojson", json=dir_payload, headers=headers, timeout=30)
-        dir_response.raise_for_status()
-        
-        dir_result = dir_response.json()
+        dir_payload = {"coordinates": np.ascontiguousarray(ordered_df[["Longitude", "Latitude"]].to_numpy(dtype=np.float64))}
+        dir_result = _post_ors_cached("/v2/directions/driving-car/geojson", dir_payload, headers, 30, required_key="features")
+
         summary = dir_result["features"][0]["properties"]["summary"]
         distance_km = summary["distance"] / 1000
         duration_min = summary["duration"] / 60
@@ -60,7 +197,7 @@ def optimize_route_online(df: pd.DataFrame, api_key: str, start_node: int = 0, e
     except requests.exceptions.RequestException as e:
         print(f"ERRO: Falha de conexão com a API do ORS: {e}")
         return None
-    except (KeyError, IndexError) as e:
+    except (KeyError, IndexError, orjson.JSONDecodeError) as e:
         print(f"ERRO: A resposta da API do ORS está em um formato inesperado: {e}")
         return None
     except Exception as e:
@@ -70,23 +207,36 @@ def optimize_route_online(df: pd.DataFrame, api_key: str, start_node: int = 0, e
 def geocode_address(address: str, api_key: str) -> Optional[Tuple[float, float]]:
     """
     Converte um endereço de texto em coordenadas geográficas (geocodificação).
+    Os resultados ficam guardados em disco, evitando consultas repetidas à API.
+    Consultas à API respeitam ORS_GEOCODE_RPM e podem esperar por um token.
     """
+    cache_key = _cache_key(address)
+    cached = _GEOCODE_CACHE.get(cache_key, _MISSING)
+    if cached is not _MISSING:
+        return tuple(cached) if cached else None
+
     try:
         params = {"text": address, "size": 1}
         headers = {"Authorization": api_key}
-        response = requests.get(f"{ORS_BASE_URL}/geocode/search", headers=headers, params=params, timeout=10)
+        _GEOCODE_LIMITER.acquire()
+        response = _SESSION.get(f"{ORS_BASE_URL}/geocode/search", headers=headers, params=params, timeout=10)
         response.raise_for_status()
-        data = response.json()
+        data = orjson.loads(response.content)
         
         if data and data.get("features"):
             coords = data["features"][0]["geometry"]["coordinates"]
-            return coords[1], coords[0] 
+            result = (coords[1], coords[0])
+            _GEOCODE_CACHE.set(cache_key, result, expire=GEOCODE_CACHE_TTL)
         else:
-            return None
+            # Endereço não encontrado: guardado por pouco tempo, só para não repetir
+            # a consulta na mesma leva; a base do ORS pode passar a conhecê-lo.
+            result = None
+            _GEOCODE_CACHE.set(cache_key, result, expire=GEOCODE_MISS_CACHE_TTL)
+        return result
     except requests.exceptions.RequestException as e:
         print(f"ERRO: Falha de conexão na geocodificação: {e}")
         return None
-    except (KeyError, IndexError) as e:
+    except (KeyError, IndexError, orjson.JSONDecodeError) as e:
         print(f"ERRO: A resposta da API de geocodificação está em um formato inesperado: {e}")
         return None
 
@@ -96,6 +246,18 @@ def autocomplete_address(text: str, api_key: str) -> List[str]:
     """
     if not text or len(text) < 3:
         return []
+
+    query = _normalize_query(text)
+    narrowed = _narrow_from_prefix(query)
+    if narrowed is not None:
+        _remember_suggestions(query, narrowed)
+        return narrowed
+
+    cache_key = _cache_key(text)
+    cached = _AUTOCOMPLETE_CACHE.get(cache_key)
+    if cached is not None:
+        _remember_suggestions(query, cached)
+        return cached
     
     try:
         params = {
@@ -105,18 +267,46 @@ def autocomplete_address(text: str, api_key: str) -> List[str]:
         }
         headers = {"Authorization": api_key}
         
-        response = requests.get(f"{ORS_BASE_URL}/geocode/autocomplete", headers=headers, params=params, timeout=5)
+        response = _SESSION.get(f"{ORS_BASE_URL}/geocode/autocomplete", headers=headers, params=params, timeout=5)
         response.raise_for_status()
-        data = response.json()
+        data = orjson.loads(response.content)
         
         if data and data.get("features"):
-            return [feature["properties"]["label"] for feature in data["features"]]
+            suggestions = [feature["properties"]["label"] for feature in data["features"]]
         else:
-            return []
+            suggestions = []
+        _AUTOCOMPLETE_CACHE.set(cache_key, suggestions, expire=AUTOCOMPLETE_CACHE_TTL)
+        _remember_suggestions(query, suggestions)
+        return suggestions
             
     except requests.exceptions.RequestException as e:
         print(f"ERRO: Falha de conexão no autocomplete: {e}")
         return []
-    except (KeyError, IndexError) as e:
+    except (KeyError, IndexError, orjson.JSONDecodeError) as e:
         print(f"ERRO: A resposta da API de autocomplete está em um formato inesperado: {e}")
         return []
+
+def autocomplete_address_async(
+    text: str, api_key: str, fetch: Callable[[str, str], List[str]] = autocomplete_address
+) -> Future:
+    """
+    Agenda o autocomplete numa thread de fundo e retorna imediatamente um
+    Future que resolve para a lista de sugestões. `fetch` permite trocar a
+    função de busca; como em geocode_many, ela não pode usar st.cache_data.
+    """
+    return _EXECUTOR.submit(fetch, text, api_key)
+
+def geocode_many(
+    addresses: List[str], api_key: str,
+    fetch: Callable[[str, str], Optional[Tuple[float, float]]] = geocode_address
+) -> List[Optional[Tuple[float, float]]]:
+    """
+    Geocodifica vários endereços em paralelo, com no máximo ORS_MAX_WORKERS
+    requisições simultâneas e ORS_GEOCODE_RPM por minuto (acertos do cache não
+    contam). O resultado segue a mesma ordem da entrada. `fetch` roda nas
+    threads de fundo, sem ScriptRunContext: funções com st.cache_data não
+    servem ali, pois registram um aviso no log a cada chamada.
+    """
+    if not addresses:
+        return []
+    return list(_EXECUTOR.map(lambda address: fetch(address, api_key), addresses))
@@ -1,8 +1,11 @@
 # src/utils.py
 # Módulo de utilitários com funções compartilhadas pelo projeto.
-# VERSÃO 3.0.1: Criação do módulo e centralização da função _haversine_distance.
+# VERSÃO 3.0.9: Token bucket (RateLimiter) compartilhado pelas chamadas às APIs externas.
 
 import math
+import threading
+import time
+import numpy as np
 
 def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> int:
     """
@@ -35,23 +38,127 @@ def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> in
 
     # Aplicação da fórmula de Haversine
     a = math.sin(delta_lat / 2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(delta_lon / 2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    # 2·asin(√a) equivale a 2·atan2(√a, √(1−a)) com uma raiz a menos; o min()
+    # protege contra a > 1 por arredondamento em pontos antípodas.
+    c = 2 * math.asin(math.sqrt(min(1.0, a)))
 
     distance = R * c
     return int(distance)
 
+def haversine_distances(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """
+    Versão vetorizada de `haversine_distance`: calcula, com NumPy, a distância
+    em metros entre cada ponto i de (lat1, lon1) e o ponto i de (lat2, lon2).
+
+    Returns:
+        np.ndarray: Vetor de inteiros (int64) truncados para metros, como em
+                    `haversine_distance`.
+    """
+    R = 6371000  # Raio da Terra em metros
+
+    lat1_rad = np.radians(np.asarray(lat1, dtype=np.float64))
+    lon1_rad = np.radians(np.asarray(lon1, dtype=np.float64))
+    lat2_rad = np.radians(np.asarray(lat2, dtype=np.float64))
+    lon2_rad = np.radians(np.asarray(lon2, dtype=np.float64))
+
+    a = np.sin((lat2_rad - lat1_rad) * 0.5)**2 + np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin((lon2_rad - lon1_rad) * 0.5)**2
+    # Mesma forma de `haversine_matrix`: 2·asin(√a), com a limitado a [0, 1].
+    c = 2 * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+    return (R * c).astype(np.int64)
 
+def haversine_matrix(latitudes, longitudes, dtype=np.float64) -> np.ndarray:
+    """
+    Calcula a matriz de distâncias (em metros) entre todos os pares de pontos
+    usando a fórmula de Haversine, de forma vetorizada com NumPy.
+
+    Args:
+        latitudes: Sequência ou array com as latitudes dos pontos.
+        longitudes: Sequência ou array com as longitudes dos pontos.
+        dtype: Precisão dos cálculos intermediários. `np.float32` usa metade da
+               memória e mantém erro da ordem de poucos metros, suficiente para
+               ordenar uma rota.
+
+    Returns:
+        np.ndarray: Matriz N x N de inteiros (int64), onde o elemento [i, j] é a
+                    distância entre os pontos i e j, truncada para metros inteiros
+                    como em `haversine_distance`.
+    """
+    R = 6371000  # Raio da Terra em metros
+
+    lat = np.radians(np.asarray(latitudes, dtype=dtype))
+    lon = np.radians(np.asarray(longitudes, dtype=dtype))
+    half_lat = lat * 0.5
+    half_lon = lon * 0.5
+    cos_lat = np.cos(lat)
+
+    # Diferenças entre todos os pares (N x N). Cada etapa grava sobre a própria
+    # matriz (out=...), então só duas matrizes N x N existem ao mesmo tempo.
+    a = np.subtract.outer(half_lat, half_lat)
+    np.sin(a, out=a)
+    np.square(a, out=a)
+
+    b = np.subtract.outer(half_lon, half_lon)
+    np.sin(b, out=b)
+    np.square(b, out=b)
+    b *= cos_lat[:, None]
+    b *= cos_lat[None, :]
+    a += b
+    del b
+
+    np.clip(a, 0, 1, out=a)
+    np.sqrt(a, out=a)
+    np.arcsin(a, out=a)
+    a *= 2 * R
+    return a.astype(np.int64)
+
+
+class RateLimiter:
+    """
+    Token bucket compartilhado pelas threads: libera até `rate` chamadas por
+    minuto e faz a thread esperar quando os tokens acabam, em vez de deixar a
+    API responder 429.
+    """
+
+    def __init__(self, rate: int, period: float = 60.0):
+        self.capacity = float(rate)
+        self.tokens = float(rate)
+        self.fill_rate = rate / period
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.fill_rate
+            time.sleep(wait)
+
+
+import functools
 import streamlit as st
 from typing import Dict
 
+@functools.lru_cache(maxsize=1)
 def get_api_keys() -> Dict[str, str]:
     """
     Busca todas as chaves de API necessárias dos segredos do Streamlit
-    e as retorna em um dicionário.
+    e as retorna em um dicionário. A leitura acontece uma única vez por
+    processo; alterações no secrets.toml exigem reiniciar o app.
     """
+    try:
+        secrets = dict(st.secrets)
+    except FileNotFoundError:
+        print("ERRO: Nenhum secrets.toml encontrado; as chaves de API ficarão vazias.")
+        secrets = {}
+
     keys = {
-        "GEMINI_API_KEY": st.secrets.get("GEMINI_API_KEY", ""),
-        "ORS_API_KEY": st.secrets.get("ORS_API_KEY", ""),
-        "AI_PASSWORD": st.secrets.get("AI_PASSWORD", "")
+        "GEMINI_API_KEY": secrets.get("GEMINI_API_KEY", ""),
+        "ORS_API_KEY": secrets.get("ORS_API_KEY", ""),
+        "AI_PASSWORD": secrets.get("AI_PASSWORD", "")
     }
     return keys